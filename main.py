@@ -1,11 +1,27 @@
 #!/usr/bin/env python3
 
+import hashlib
+import importlib.util
+import json
+import os
+import shutil
+import struct
+import tempfile
+import time
+import weakref
+from array import array
 from argparse import ArgumentParser, Namespace, RawDescriptionHelpFormatter
-from dataclasses import dataclass
-from enum import IntEnum, auto
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import astuple, dataclass, replace
+from enum import Enum, IntEnum, auto
+from fractions import Fraction
+from itertools import chain, pairwise, repeat
 from math import ceil, cos, floor, pi, radians, sin
-from typing import Callable, Sequence
+from operator import itemgetter
+from types import ModuleType
+from typing import Callable, Iterable, Iterator, Sequence
 
+import numpy as np
 from PIL import Image, ImageDraw
 
 
@@ -18,9 +34,94 @@ class Command(IntEnum):
     STOREPOS = auto()
     GOTOPOS = auto()
     NOACTION = auto()
+    # move forward without drawing, only emitted by `PeepholeOptimizer`
+    JUMP = auto()
 
 
 NamedCommand = tuple[str, Command]
+# a named command repeated a number of times
+Run = tuple[NamedCommand, int]
+# a command repeated a number of times
+Instruction = tuple[Command, int]
+
+# number of opcodes decoded at a time when feeding an opcode array to the turtle
+DECODE_CHUNK_SIZE = 1 << 16
+# number of opcodes expanded at a time by `expand_opcodes`, bounding its index arrays
+EXPAND_CHUNK_SIZE = 1 << 16
+# levels shorter than this are expanded in process even when worker processes are available
+PARALLEL_MIN_SYMBOLS = 1 << 20
+# chunks per worker process, so that uneven chunks still keep every worker busy
+CHUNKS_PER_JOB = 4
+# memory backed file system holding levels shared with worker processes, when available
+SHARED_MEMORY_DIR = "/dev/shm"
+# number of opcodes of an on disk level expanded at a time by the mmap engine
+MMAP_CHUNK_SIZE = 1 << 22
+# level files start with this magic, the alphabet's size in bytes and the number of symbols,
+# followed by the alphabet as json and then one opcode byte per symbol
+LEVEL_FILE_MAGIC = b"LSYSTEM\0"
+LEVEL_FILE_HEADER = struct.Struct("<8sIQ")
+# levels up to this many symbols check a compiled ruleset against the loop interpreter
+COMPILE_CHECK_SYMBOLS = 1 << 12
+# deepest level `LSystem.choose_depth` considers
+MAX_AUTO_DEPTH = 64
+# levels up to this many symbols are run to calibrate `CostModel`, repeatedly until this
+# many symbols and lines are measured
+CALIBRATION_SYMBOLS = 1 << 14
+# or until this many seconds are spent on each
+CALIBRATION_SECONDS = 0.1
+# largest subtree, in symbols, whose lines the instanced interpreter memoizes
+INSTANCE_MAX_SYMBOLS = 1 << 12
+# largest subtree, in symbols, whose optimized instructions the optimizer memoizes
+OPTIMIZE_MAX_SYMBOLS = 1 << 12
+# instructions the optimizer holds before handing out those it can no longer change
+OPTIMIZE_SETTLE_SIZE = 1 << 14
+# most distinct headings tracked exactly, enough for any angle given to hundredths of a degree
+MAX_HEADINGS = 1 << 16
+# largest error in radians for an angle to count as a fraction of a full turn
+HEADING_TOLERANCE = 1e-9
+
+
+class Engine(Enum):
+    """Storage and expansion strategy for the system value"""
+
+    # python list of named commands, expanded one symbol at a time
+    LIST = "list"
+    # uint8 opcode array indexing `LSystem.alphabet`, expanded with numpy
+    ARRAY = "array"
+    # the seed is kept and expanded depth first while the turtle runs, never materialized
+    STREAM = "stream"
+    # uint8 opcodes in a memory mapped level file, expanded and run in chunks
+    MMAP = "mmap"
+    # list of runs of identical named commands, rewritten and run a run at a time
+    RLE = "rle"
+    # bytes of opcodes, rewritten and run by python code generated for the ruleset
+    COMPILED = "compiled"
+
+
+class Interpreter(Enum):
+    """Strategy for running the system value on the canvas"""
+
+    # python loop over the commands, one at a time
+    LOOP = "loop"
+    # numpy scans computing every heading and position of the level at once
+    VECTOR = "vector"
+    # python loops over chunks of the level in worker processes, each starting from a
+    # turtle state computed from the memoized subtree transforms
+    PARALLEL = "parallel"
+    # python loop over the rule tree from the seed, jumping over subtrees outside the
+    # canvas by their memoized transforms
+    CULLED = "culled"
+    # the culled interpreter's walk, placing memoized lines of small subtrees with numpy
+    # affine transforms instead of walking each occurrence
+    INSTANCED = "instanced"
+
+
+# interpreters walking the rule tree from the seed, which never read the expanded level
+RULE_TREE_INTERPRETERS = (
+    Interpreter.PARALLEL,
+    Interpreter.CULLED,
+    Interpreter.INSTANCED,
+)
 
 
 @dataclass
@@ -30,17 +131,596 @@ class Cursor:
     angle: float
     is_down: bool
 
-    def move_forward(self, movement_length: float):
-        """Moves the cursor forward in the direction it is facing"""
-        self.x += movement_length * cos(self.angle)
-        # subtract because need to reverse up and down from sin
-        self.y -= movement_length * sin(self.angle)
 
-    def rotate_ccw(self, radians: float):
-        self.angle += radians
+TurtleStack = tuple[list[float], list[float], list[int], list[bool]]
+
+
+def allocate_turtle_stack(size: int) -> TurtleStack:
+    """Returns parallel lists of the x, y, turns and pen state of `size` saved cursors"""
+    return [0.0] * size, [0.0] * size, [0] * size, [False] * size
+
+
+def grow_turtle_stack(*stack: list) -> int:
+    """Doubles the capacity of the parallel lists of a turtle stack, returning it.
+    Only needed when more cursors are saved than the level's stack depth predicted.
+    """
+    for saved in stack:
+        saved.extend([0] * (len(saved) + 1))
+    return len(stack[0])
+
+
+def unit_circle(count: int) -> list[tuple[float, float]]:
+    """Returns the cosine and sine of `count` headings evenly dividing the full turn.
+    Quarter turns are exact, and mirrored headings have mirrored vectors.
+    """
+    vectors = []
+    for i in range(count):
+        if 4 * i % count == 0:
+            vectors.append(
+                [(1.0, 0.0), (0.0, 1.0), (-1.0, 0.0), (0.0, -1.0)][4 * i // count]
+            )
+        elif 2 * i > count:
+            c, s = vectors[count - i]
+            vectors.append((c, -s))
+        else:
+            vectors.append((cos(2 * pi * i / count), sin(2 * pi * i / count)))
+    return vectors
+
+
+class HeadingTable(dict[int, tuple[float, float]]):
+    """Cosine and sine of the headings reached from `angle` by whole numbers of
+    counter-clockwise rotations by `rotate_angle`, keyed by the number of rotations.
+    When `rotate_angle` is a fraction p/q of the full turn, a number of rotations is an
+    index modulo q into precomputed vectors, exact when `angle` is itself a multiple of
+    1/q turn. Otherwise each vector is computed from its number of rotations on first use,
+    so headings never drift however many rotations accumulate.
+    """
+
+    def __init__(self, angle: float, rotate_angle: float):
+        super().__init__()
+        self.angle = angle
+        self.rotate_angle = rotate_angle
+        turn = Fraction(rotate_angle / (2 * pi)).limit_denominator(MAX_HEADINGS)
+        # number of distinct headings, None when they do not repeat
+        self.count: int | None = None
+        if abs(2 * pi * turn - rotate_angle) < HEADING_TOLERANCE:
+            self.count = turn.denominator
+            self.step = turn.numerator
+            self.offset = round(angle * self.count / (2 * pi))
+            if abs(2 * pi * self.offset / self.count - angle) < HEADING_TOLERANCE:
+                self.vectors = unit_circle(self.count)
+            else:
+                self.offset = 0
+                self.vectors = [
+                    (
+                        cos(angle + 2 * pi * i / self.count),
+                        sin(angle + 2 * pi * i / self.count),
+                    )
+                    for i in range(self.count)
+                ]
+
+    def __missing__(self, turns: int) -> tuple[float, float]:
+        if self.count is None:
+            heading = self.angle + turns * self.rotate_angle
+            vector = (cos(heading), sin(heading))
+        else:
+            vector = self.vectors[(turns * self.step + self.offset) % self.count]
+        self[turns] = vector
+        return vector
+
+    def vectors_of(self, turns: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the cosines and sines of the headings for every number of rotations"""
+        if self.count is None:
+            headings = self.angle + turns * self.rotate_angle
+            return np.cos(headings), np.sin(headings)
+        vectors = np.array(self.vectors).reshape(-1, 2)
+        indices = (turns * self.step + self.offset) % self.count
+        return vectors[indices, 0], vectors[indices, 1]
+
+
+def expand_opcodes(
+    level: np.ndarray,
+    rule_lengths: np.ndarray,
+    rule_table: np.ndarray,
+    new_level: np.ndarray | None = None,
+) -> np.ndarray:
+    """Rewrites an opcode array once using the replacement tables of `LSystem.build_rule_table`.
+    Symbol i of the new level is symbol i - s of the replacement starting at s, so each
+    chunk of the level is written with one gather from the concatenated replacements.
+    The result is written into `new_level` when given, which must have the right length.
+    """
+    if new_level is None:
+        total = sum(
+            int(rule_lengths[level[i : i + EXPAND_CHUNK_SIZE]].sum())
+            for i in range(0, len(level), EXPAND_CHUNK_SIZE)
+        )
+        new_level = np.empty(total, dtype=np.uint8)
+    # where the replacement of each opcode starts in the concatenated replacements
+    offsets = np.cumsum(rule_lengths) - rule_lengths
+    start = 0
+    for i in range(0, len(level), EXPAND_CHUNK_SIZE):
+        chunk = level[i : i + EXPAND_CHUNK_SIZE]
+        lengths = rule_lengths[chunk]
+        ends = np.cumsum(lengths)
+        stop = start + int(ends[-1])
+        indices = np.repeat(offsets[chunk] - (ends - lengths), lengths)
+        indices += np.arange(stop - start)
+        new_level[start:stop] = rule_table[indices]
+        start = stop
+    return new_level
+
+
+def expand_runs(
+    opcodes: np.ndarray,
+    counts: np.ndarray,
+    run_lengths: np.ndarray,
+    run_opcodes: np.ndarray,
+    run_counts: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Rewrites a run length encoded level, the opcode and count of each of its runs,
+    once using the replacement tables of `LSystem.build_run_table`.
+    A run of k symbols whose replacement is a single run of m symbols becomes one run of
+    k * m symbols, and any other replacement is repeated k times; adjacent runs of the
+    same opcode are then merged. Each chunk of runs is rewritten with one gather, so the
+    work done depends on the number of runs, not of symbols.
+    """
+    # where the runs of the replacement of each opcode start in the concatenated runs
+    offsets = np.cumsum(run_lengths) - run_lengths
+    new_opcodes = [np.empty(0, dtype=np.uint8)]
+    new_counts = [np.empty(0, dtype=np.int64)]
+    for i in range(0, len(opcodes), EXPAND_CHUNK_SIZE):
+        chunk = opcodes[i : i + EXPAND_CHUNK_SIZE]
+        chunk_counts = counts[i : i + EXPAND_CHUNK_SIZE]
+        lengths = run_lengths[chunk]
+        is_single = lengths == 1
+        copies = np.where(is_single, 1, chunk_counts)
+        emitted = lengths * copies
+        ends = np.cumsum(emitted)
+        # position of each new run among the runs of its replacement
+        within = np.arange(ends[-1]) - np.repeat(ends - emitted, emitted)
+        within %= np.repeat(lengths, emitted)
+        indices = np.repeat(offsets[chunk], emitted) + within
+        child_opcodes = run_opcodes[indices]
+        scales = np.repeat(np.where(is_single, chunk_counts, 1), emitted)
+        child_counts = run_counts[indices] * scales
+        if len(child_opcodes) == 0:
+            continue
+        # merge within the chunk, then with the last run of the chunk before it
+        starts = np.flatnonzero(
+            np.concatenate(([True], child_opcodes[1:] != child_opcodes[:-1]))
+        )
+        child_opcodes = child_opcodes[starts]
+        child_counts = np.add.reduceat(child_counts, starts)
+        if len(new_opcodes[-1]) and new_opcodes[-1][-1] == child_opcodes[0]:
+            new_counts[-1][-1] += child_counts[0]
+            child_opcodes = child_opcodes[1:]
+            child_counts = child_counts[1:]
+        if len(child_opcodes):
+            new_opcodes.append(child_opcodes)
+            new_counts.append(child_counts)
+    return np.concatenate(new_opcodes), np.concatenate(new_counts)
+
+
+def expand_opcodes_chunk(
+    level_path: str,
+    start: int,
+    stop: int,
+    new_level_path: str,
+    new_start: int,
+    new_stop: int,
+    rule_lengths: np.ndarray,
+    rule_table: np.ndarray,
+) -> None:
+    """Worker process task expanding `level[start:stop]` into `new_level[new_start:new_stop]`.
+    Both levels are memory mapped files, so only their paths cross process boundaries.
+    """
+    level = np.memmap(level_path, dtype=np.uint8, mode="r")
+    new_level = np.memmap(new_level_path, dtype=np.uint8, mode="r+")
+    expand_opcodes(
+        level[start:stop], rule_lengths, rule_table, new_level[new_start:new_stop]
+    )
+    new_level.flush()
+
+
+def trace_chunk(
+    lsystem: "LSystem",
+    start: int,
+    stop: int,
+    cursor: "Cursor",
+    saved_cursors: list["Cursor"],
+) -> np.ndarray:
+    """Worker process task running symbols `start` to `stop` of the current level of
+    `lsystem` from `cursor` and `saved_cursors`, without expanding the level.
+    Returns the from x, from y, to x and to y of each line drawn, one line per row.
+    """
+    lines = array("d")
+
+    def record(from_x: float, from_y: float, to_x: float, to_y: float):
+        lines.extend((from_x, from_y, to_x, to_y))
+
+    lsystem.cursor = cursor
+    lsystem.saved_cursors = saved_cursors
+    symbols = lsystem.iter_symbols(start, stop)
+    lsystem.run_commands((command for _, command in symbols), record)
+    return np.frombuffer(lines).reshape(-1, 4)
+
+
+# source run by the compiled interpreter loop for each command, at the indentation
+# of the loop body
+COMPILED_ACTIONS = {
+    Command.MOVEFORWARD: [
+        "c, s = headings[turns]",
+        "to_x = x + movement_length * c",
+        "to_y = y - movement_length * s",
+        "if is_down:",
+        "    draw(x, y, to_x, to_y)",
+        "x = to_x",
+        "y = to_y",
+    ],
+    Command.ROTATECCW: ["turns += 1"],
+    Command.ROTATECW: ["turns -= 1"],
+    Command.STOREPOS: [
+        "if top == size:",
+        "    size = grow_turtle_stack(saved_x, saved_y, saved_turns, saved_is_down)",
+        "saved_x[top] = x",
+        "saved_y[top] = y",
+        "saved_turns[top] = turns",
+        "saved_is_down[top] = is_down",
+        "top += 1",
+    ],
+    Command.GOTOPOS: [
+        "if top:",
+        "    top -= 1",
+        "    to_x = saved_x[top]",
+        "    to_y = saved_y[top]",
+        "    turns = saved_turns[top]",
+        "else:",
+        "    saved_cursor = lsystem.saved_cursors.pop()",
+        "    to_x = saved_cursor.x",
+        "    to_y = saved_cursor.y",
+        "    angle = saved_cursor.angle",
+        "    turns = 0",
+        "    headings = lsystem.heading_table(angle)",
+        "if is_down:",
+        "    draw(x, y, to_x, to_y)",
+        "x = to_x",
+        "y = to_y",
+    ],
+    Command.PENDOWN: ["is_down = True"],
+    Command.PENUP: ["is_down = False"],
+}
+# compiled ruleset modules, keyed by a hash of their source
+COMPILED_RULESETS: dict[str, ModuleType] = {}
+# deepest level each compiled ruleset was checked up to, None once every level short
+# enough to check was
+COMPILED_CHECKED_LEVELS: dict[str, int | None] = {}
+
+
+Bounds = tuple[float, float, float, float]
+
+
+@dataclass(frozen=True)
+class Transform:
+    """Net effect of running a subtree on the cursor that starts it.
+    Positions are in units of the movement length, in the frame of the starting cursor:
+    x points along its heading and y to its left.
+    """
+
+    dx: float
+    dy: float
+    # net number of counter-clockwise rotations by the rotation angle
+    turns: int
+    # pen state on exit, indexed by the pen state on entry
+    pen: tuple[bool, bool]
+    # number of lines drawn, indexed by the pen state on entry
+    draws: tuple[int, int]
+
+    def then(self, other: "Transform", headings: "HeadingTable") -> "Transform":
+        """Composes this transform with `other` running right after it, where `headings`
+        holds the headings reached from the starting heading
+        """
+        c, s = headings[self.turns]
+        return Transform(
+            self.dx + c * other.dx - s * other.dy,
+            self.dy + s * other.dx + c * other.dy,
+            self.turns + other.turns,
+            (other.pen[self.pen[False]], other.pen[self.pen[True]]),
+            (
+                self.draws[False] + other.draws[self.pen[False]],
+                self.draws[True] + other.draws[self.pen[True]],
+            ),
+        )
+
+    def restore(self, saved: "Transform") -> "Transform":
+        """Applies a `Command.GOTOPOS` returning to `saved`, the transform of an earlier
+        prefix
+        """
+        return Transform(
+            saved.dx,
+            saved.dy,
+            saved.turns,
+            self.pen,
+            (self.draws[False] + self.pen[False], self.draws[True] + self.pen[True]),
+        )
+
+
+IDENTITY = Transform(0.0, 0.0, 0, (False, True), (0, 0))
+LEAF_TRANSFORMS = {
+    Command.PENDOWN: replace(IDENTITY, pen=(True, True)),
+    Command.PENUP: replace(IDENTITY, pen=(False, False)),
+    Command.MOVEFORWARD: replace(IDENTITY, dx=1.0, draws=(0, 1)),
+    Command.ROTATECCW: replace(IDENTITY, turns=1),
+    Command.ROTATECW: replace(IDENTITY, turns=-1),
+    Command.NOACTION: IDENTITY,
+}
+
 
-    def rotate_cw(self, radians: float):
-        self.angle -= radians
+@dataclass(frozen=True)
+class PenTransducer:
+    """Net effect of running a subtree on the pen state and the number of lines drawn,
+    the only things that matter for counting lines. Both depend on nothing but the pen
+    state on entry, whatever the brackets of the subtree.
+    """
+
+    # pen state on exit, indexed by the pen state on entry
+    pen: tuple[bool, bool]
+    # number of lines drawn, indexed by the pen state on entry
+    draws: tuple[int, int]
+
+    def then(self, other: "PenTransducer") -> "PenTransducer":
+        """Composes this transducer with `other` running right after it"""
+        return PenTransducer(
+            (other.pen[self.pen[False]], other.pen[self.pen[True]]),
+            (
+                self.draws[False] + other.draws[self.pen[False]],
+                self.draws[True] + other.draws[self.pen[True]],
+            ),
+        )
+
+
+PEN_IDENTITY = PenTransducer((False, True), (0, 0))
+LEAF_PEN_TRANSDUCERS = {
+    Command.PENDOWN: PenTransducer((True, True), (0, 0)),
+    Command.PENUP: PenTransducer((False, False), (0, 0)),
+    Command.MOVEFORWARD: PenTransducer((False, True), (0, 1)),
+    Command.GOTOPOS: PenTransducer((False, True), (0, 1)),
+}
+
+
+@dataclass(frozen=True)
+class StackProfile:
+    """Net effect of running a subtree on the number of saved cursors, relative to the
+    number saved on entry. A level can be run from no saved cursors when its `lowest`
+    is zero, and needs room for `highest` saved cursors.
+    """
+
+    # change in the number of saved cursors
+    net: int
+    # fewest and most saved cursors at any point
+    lowest: int
+    highest: int
+
+    def then(self, other: "StackProfile") -> "StackProfile":
+        """Composes this profile with `other` running right after it"""
+        return StackProfile(
+            self.net + other.net,
+            min(self.lowest, self.net + other.lowest),
+            max(self.highest, self.net + other.highest),
+        )
+
+
+STACK_IDENTITY = StackProfile(0, 0, 0)
+LEAF_STACK_PROFILES = {
+    Command.STOREPOS: StackProfile(1, 0, 1),
+    Command.GOTOPOS: StackProfile(-1, -1, 0),
+}
+
+
+def rotate_bounds(bounds: Bounds, c: float, s: float) -> Bounds:
+    """Bounds of a box rotated by the angle with cosine `c` and sine `s`.
+    Exact for multiples of 90 degrees, otherwise a box containing the rotated box.
+    """
+    min_x, min_y, max_x, max_y = bounds
+    xs = (
+        c * min_x - s * min_y,
+        c * min_x - s * max_y,
+        c * max_x - s * min_y,
+        c * max_x - s * max_y,
+    )
+    ys = (
+        s * min_x + c * min_y,
+        s * min_x + c * max_y,
+        s * max_x + c * min_y,
+        s * max_x + c * max_y,
+    )
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+@dataclass
+class SegmentBuffer:
+    """Lines drawn by running a system value, stored as columns with one row per line"""
+
+    from_x: np.ndarray
+    from_y: np.ndarray
+    to_x: np.ndarray
+    to_y: np.ndarray
+    # position of the line in drawing order
+    draw: np.ndarray
+    # pen width in pixels
+    width: np.ndarray
+    # color packed as 0xRRGGBB
+    color: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.draw)
+
+
+# receives the from x, from y, to x and to y of each line drawn, in drawing order
+DrawLine = Callable[[float, float, float, float], None]
+
+
+class PeepholeOptimizer:
+    """Rewrites instructions into fewer instructions that draw the same lines.
+    Symbols without effect and pen commands that do not change the pen are dropped,
+    consecutive rotations are summed, consecutive moves become one move while drawing
+    or one `Command.JUMP` while not, and branches that draw nothing, including
+    their return, are replaced by their change to the pen.
+    Only the last instruction and those since the earliest open branch that may still be
+    replaced can change, so the others are handed out by `settle` as they are added.
+    """
+
+    def __init__(self, is_down: bool):
+        # instructions not handed out yet
+        self.optimized: list[Instruction] = []
+        self.is_down = is_down
+        self.draws = 0
+        # (index among all instructions, draws, pen state) at each open branch
+        self.branches: list[tuple[int, int, bool]] = []
+        # number of instructions handed out
+        self.settled = 0
+
+    def set_pen(self, is_down: bool):
+        if is_down == self.is_down:
+            return
+        self.is_down = is_down
+        optimized = self.optimized
+        if optimized and optimized[-1][0] in (Command.PENUP, Command.PENDOWN):
+            # the previous pen command had no effect
+            optimized.pop()
+        else:
+            optimized.append((Command.PENDOWN if is_down else Command.PENUP, 1))
+
+    def add(self, command: Command, count: int) -> None:
+        """Adds `command` repeated `count` times"""
+        optimized = self.optimized
+        match command:
+            case Command.PENDOWN:
+                self.set_pen(True)
+            case Command.PENUP:
+                self.set_pen(False)
+            case Command.MOVEFORWARD | Command.JUMP:
+                if command == Command.MOVEFORWARD and self.is_down:
+                    self.draws += count
+                else:
+                    command = Command.JUMP
+                if optimized and optimized[-1][0] == command:
+                    count += optimized.pop()[1]
+                optimized.append((command, count))
+            case Command.ROTATECCW | Command.ROTATECW:
+                turns = count if command == Command.ROTATECCW else -count
+                if optimized and optimized[-1][0] == Command.ROTATECCW:
+                    turns += optimized.pop()[1]
+                elif optimized and optimized[-1][0] == Command.ROTATECW:
+                    turns -= optimized.pop()[1]
+                if turns > 0:
+                    optimized.append((Command.ROTATECCW, turns))
+                elif turns < 0:
+                    optimized.append((Command.ROTATECW, -turns))
+            case Command.STOREPOS:
+                for _ in range(count):
+                    index = self.settled + len(optimized)
+                    self.branches.append((index, self.draws, self.is_down))
+                    optimized.append((Command.STOREPOS, 1))
+            case Command.GOTOPOS:
+                branches = self.branches
+                for _ in range(count):
+                    if branches and not self.is_down and branches[-1][1] == self.draws:
+                        start, _, start_is_down = branches.pop()
+                        del optimized[start - self.settled :]
+                        # the pen state is not restored by returning
+                        self.is_down = start_is_down
+                        self.set_pen(False)
+                    else:
+                        if branches:
+                            branches.pop()
+                        optimized.append((Command.GOTOPOS, 1))
+                        self.draws += self.is_down
+            case _:
+                pass
+
+    def add_chunk(self, chunk: list[Instruction], draws: int, is_down: bool) -> None:
+        """Adds `chunk`, instructions optimized on their own from the current pen state
+        that close every branch they open, draw `draws` lines and leave the pen `is_down`.
+        Only its leading instructions are added one at a time, until one is kept as is;
+        the rest cannot merge with the instructions before it and is appended whole.
+        """
+        optimized = self.optimized
+        draws += self.draws
+        i = 0
+        while i < len(chunk) and chunk[i][0] != Command.STOREPOS:
+            length = len(optimized)
+            self.add(*chunk[i])
+            i += 1
+            if len(optimized) > length:
+                break
+        optimized.extend(chunk[i:])
+        self.draws = draws
+        self.is_down = is_down
+
+    def settle(self) -> list[Instruction]:
+        """Removes and returns the instructions later instructions can no longer change"""
+        keep = self.settled + len(self.optimized) - 1
+        for start, draws, _ in reversed(self.branches):
+            # branches that drew lines stay, and so do the branches outside them
+            if draws != self.draws:
+                break
+            keep = start
+        settled = self.optimized[: keep - self.settled]
+        del self.optimized[: len(settled)]
+        self.settled += len(settled)
+        return settled
+
+    def finish(self) -> list[Instruction]:
+        """Removes and returns every remaining instruction"""
+        remaining = self.optimized
+        self.optimized = []
+        self.settled += len(remaining)
+        return remaining
+
+
+@dataclass
+class CostModel:
+    """Seconds a render takes per symbol of the level and per line drawn, measured by
+    `LSystem.calibrate_cost_model`
+    """
+
+    seconds_per_symbol: float
+    seconds_per_line: float
+
+    def predict(self, symbols: int, lines: int) -> float:
+        """Predicts the seconds rendering a level of `symbols` drawing `lines` takes"""
+        return symbols * self.seconds_per_symbol + lines * self.seconds_per_line
+
+
+@dataclass
+class DepthChoice:
+    """Deepest level fitting a render budget, chosen by `LSystem.choose_depth`"""
+
+    level: int
+    symbols: int
+    lines: int
+    # predicted seconds to render the level
+    seconds: float
+    # length of each line in pixels
+    segment_length: float
+    # why the next level was not chosen
+    reason: str
+
+
+@dataclass
+class GrowthPrediction:
+    """Size of a level of an L-System, predicted without expanding it"""
+
+    # iteration the prediction is for
+    level: int
+    # total number of symbols in the level
+    symbols: int
+    # number of occurrences of each symbol name in the level
+    histogram: dict[str, int]
+    # number of `Command.MOVEFORWARD` symbols in the level
+    forward_moves: int
+    # factor the symbol count is asymptotically multiplied by on each iteration
+    growth_rate: float
 
 
 class LSystem:
@@ -57,6 +737,14 @@ class LSystem:
         movement_length: float = 5.0,
         pen_thickness: int = 5,
         rotate_angle: float = pi / 2.0,
+        engine: Engine = Engine.LIST,
+        jobs: int = 1,
+        cache_dir: str | None = None,
+        storage_dir: str | None = None,
+        prune: bool = False,
+        optimize: bool = False,
+        interpreter: Interpreter = Interpreter.LOOP,
+        lod_tolerance: float | None = None,
     ):
         self.seed = seed
         self.rules = rules
@@ -68,13 +756,76 @@ class LSystem:
         self.movement_length = movement_length
         self.pen_thickness = pen_thickness
         self.rotate_angle = rotate_angle
+        self.engine = engine
+        self.jobs = jobs
+        self.cache_dir = cache_dir
+        # where the mmap engine creates its level directory, the system's temp dir by default
+        self.storage_dir = storage_dir
+        # directory of memory mapped levels, created on first use
+        self.level_dir: str | None = None
+        # whether symbols without effect on the drawing are dropped from the final level
+        self.prune = prune
+        # number of symbols dropped by pruning
+        self.pruned_symbols = 0
+        # whether the current level was pruned, and so cannot be iterated further
+        self.is_pruned = False
+        # whether the system value is rewritten into fewer instructions before running
+        self.optimize = optimize
+        self.interpreter = interpreter
+        # extent in pixels below which the culled interpreter draws a subtree as a chord
+        self.lod_tolerance = lod_tolerance
+        # number of symbols the optimizer did not need an instruction for in the last run
+        self.eliminated_instructions = 0
+        self.alphabet = LSystem.build_alphabet(seed, rules)
+        self.opcodes = {named: opcode for opcode, named in enumerate(self.alphabet)}
+        self.rule_lengths, self.rule_table = self.build_rule_table(self.rules)
+        self.run_table = self.build_run_table(self.rules)
 
         self.canvas = Image.new(
             "RGB", (self.canvas_width, self.canvas_height), background_color
         )
         self.canvas_draw = ImageDraw.Draw(self.canvas)
-        self.system_value = seed.copy()
+        self.system_value: (
+            list[NamedCommand] | np.ndarray | tuple[np.ndarray, np.ndarray] | bytes
+        )
+        match engine:
+            case Engine.LIST | Engine.STREAM:
+                self.system_value = seed.copy()
+            case Engine.ARRAY:
+                self.system_value = self.encode(seed)
+            case Engine.RLE:
+                runs = LSystem.run_length_encode(seed)
+                self.system_value = (
+                    self.encode([named for named, _ in runs]),
+                    np.array([count for _, count in runs], dtype=np.int64),
+                )
+            case Engine.COMPILED:
+                self.system_value = self.encode(seed).tobytes()
+        # number of times the system value has been iterated
+        self.iterations = 0
+        if engine == Engine.MMAP:
+            self.system_value = self.write_level(0, [self.encode(seed)])
         self.saved_cursors: list[Cursor] = []
+        # memo of `subtree_length`, keyed by (named command, remaining depth)
+        self.lengths: dict[tuple[NamedCommand, int], int] = {}
+        # memo of `subtree_stack_profile`, keyed by (named command, remaining depth)
+        self.stack_profiles: dict[tuple[NamedCommand, int], StackProfile] = {}
+        # memo of `heading_table`, keyed by starting angle
+        self.heading_tables: dict[float, HeadingTable] = {}
+        # memo of `subtree_pen_transducer`, keyed by (named command, remaining depth)
+        self.pen_transducers: dict[tuple[NamedCommand, int], PenTransducer] = {}
+        # memo of `subtree_bounds`, keyed by (named command, remaining depth, heading)
+        self.heading_bounds: dict[tuple[NamedCommand, int, int], Bounds] = {}
+        # memo of `subtree_segments`, keyed by (named command, remaining depth, pen state,
+        # movement length)
+        self.segments: dict[tuple[NamedCommand, int, bool, float], np.ndarray] = {}
+        # memo of `subtree_instructions`, keyed by (named command, remaining depth, pen
+        # state)
+        self.optimized_subtrees: dict[
+            tuple[NamedCommand, int, bool], list[Instruction]
+        ] = {}
+        # memo of `subtree_transform`, keyed by (named command, remaining depth)
+        self.transforms: dict[tuple[NamedCommand, int], Transform] = {}
         self.cursor = Cursor(
             self.canvas_width // 2 if start_x is None else start_x,
             self.canvas_height // 2 if start_y is None else start_y,
@@ -101,6 +852,231 @@ class LSystem:
             rules[(k, names_map[k])] = [(v, names_map[v]) for v in vs]
         return rules
 
+    @staticmethod
+    def build_alphabet(
+        seed: list[NamedCommand], rules: dict[NamedCommand, list[NamedCommand]]
+    ) -> list[NamedCommand]:
+        """Collects every named command that can appear in the system, sorted by name.
+        The position of a named command in the alphabet is its opcode.
+        """
+        alphabet = set(seed) | rules.keys()
+        for replacement in rules.values():
+            alphabet.update(replacement)
+        if len(alphabet) > 0x100:
+            raise ValueError(
+                f"Alphabet of {len(alphabet)} symbols does not fit in uint8"
+            )
+        return sorted(alphabet)
+
+    def build_rule_table(
+        self, rules: dict[NamedCommand, list[NamedCommand]]
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Builds the opcode replacement tables of `rules` used by the array engine.
+        Returns the replacement length of each opcode, and the replacements of every
+        opcode concatenated in opcode order. Opcodes without a rule replace themselves.
+        """
+        replacements = [rules.get(named, [named]) for named in self.alphabet]
+        lengths = np.array([len(r) for r in replacements], dtype=np.int64)
+        table = np.array(
+            [self.opcodes[r] for replacement in replacements for r in replacement],
+            dtype=np.uint8,
+        )
+        return lengths, table
+
+    def build_run_table(
+        self, rules: dict[NamedCommand, list[NamedCommand]]
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Builds the run length encoded replacement tables of `rules` used by the rle
+        engine. Returns the number of runs in the replacement of each opcode, and the
+        opcodes and counts of the runs of every replacement concatenated in opcode order.
+        """
+        replacements = [
+            LSystem.run_length_encode(rules.get(named, [named]))
+            for named in self.alphabet
+        ]
+        lengths = np.array([len(r) for r in replacements], dtype=np.int64)
+        opcodes = np.array(
+            [self.opcodes[named] for runs in replacements for named, _ in runs],
+            dtype=np.uint8,
+        )
+        counts = np.array(
+            [count for runs in replacements for _, count in runs], dtype=np.int64
+        )
+        return lengths, opcodes, counts
+
+    def pruned_rules(self) -> dict[NamedCommand, list[NamedCommand]]:
+        """Returns a rule for every symbol of the alphabet, giving its replacement without
+        the symbols that have no effect on the drawing. Only valid for a final iteration,
+        since those symbols may still have rules of their own.
+        """
+        return {
+            named: [
+                child
+                for child in self.rules.get(named, [named])
+                if child[1] != Command.NOACTION
+            ]
+            for named in self.alphabet
+        }
+
+    def count_dead_symbols(self, n: int) -> int:
+        """Counts the symbols of the `n`th level that have no effect on the drawing"""
+        dead_names = {
+            name for name, command in self.alphabet if command == Command.NOACTION
+        }
+        histogram = self.predict_growth(n).histogram
+        return sum(count for name, count in histogram.items() if name in dead_names)
+
+    def reachable_alphabet(self) -> list[NamedCommand]:
+        """Returns the symbols of the alphabet that can appear in some level from the seed"""
+        reachable = set(self.seed)
+        pending = list(reachable)
+        while pending:
+            for child in self.rules.get(pending.pop(), []):
+                if child not in reachable:
+                    reachable.add(child)
+                    pending.append(child)
+        return [named for named in self.alphabet if named in reachable]
+
+    def production_matrix(self, alphabet: list[NamedCommand]) -> list[list[int]]:
+        """Builds the incidence matrix of the rules over `alphabet`.
+        Entry [i][j] is the number of times `alphabet[j]` appears in the replacement of
+        `alphabet[i]`, so a level's symbol counts times the matrix gives the next level's.
+        """
+        index = {named: i for i, named in enumerate(alphabet)}
+        matrix = [[0] * len(alphabet) for _ in alphabet]
+        for i, named in enumerate(alphabet):
+            for child in self.rules.get(named, [named]):
+                matrix[i][index[child]] += 1
+        return matrix
+
+    def predict_growth(self, n: int) -> GrowthPrediction:
+        """Predicts the size of the `n`th level from the seed without expanding anything,
+        by multiplying the seed's symbol counts (its Parikh vector) by the production matrix
+        `n` times. Counts are exact python integers however large the level is.
+        """
+        alphabet = self.reachable_alphabet()
+        matrix = self.production_matrix(alphabet)
+        counts = [self.seed.count(named) for named in alphabet]
+        for _ in range(n):
+            counts = [
+                sum(count * row[j] for count, row in zip(counts, matrix) if count)
+                for j in range(len(alphabet))
+            ]
+        eigenvalues = np.linalg.eigvals(np.array(matrix, dtype=np.float64))
+        return GrowthPrediction(
+            level=n,
+            symbols=sum(counts),
+            histogram={name: count for (name, _), count in zip(alphabet, counts)},
+            forward_moves=sum(
+                count
+                for (_, command), count in zip(alphabet, counts)
+                if command == Command.MOVEFORWARD
+            ),
+            growth_rate=float(max(abs(eigenvalues), default=0.0)),
+        )
+
+    def ruleset_key(self) -> str:
+        """Returns a hash identifying the rules and seed, and so every level they produce"""
+        canonical = json.dumps(
+            {
+                "rules": sorted(
+                    [name, command, [list(named) for named in replacement]]
+                    for (name, command), replacement in self.rules.items()
+                ),
+                "seed": [list(named) for named in self.seed],
+            }
+        )
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def cached_levels(self) -> dict[int, str]:
+        """Maps each level of this ruleset checkpointed in `self.cache_dir` to its file"""
+        if self.cache_dir is None or not os.path.isdir(self.cache_dir):
+            return {}
+        prefix = f"{self.ruleset_key()}-"
+        levels = {}
+        for file_name in os.listdir(self.cache_dir):
+            stem, extension = os.path.splitext(file_name)
+            if file_name.startswith(prefix) and extension == ".npy":
+                level = stem.removeprefix(prefix)
+                if level.isdigit():
+                    levels[int(level)] = os.path.join(self.cache_dir, file_name)
+        return levels
+
+    def load_checkpoint(self, n: int) -> bool:
+        """Replaces the system value with the deepest checkpointed level that is no deeper
+        than `n` but deeper than the current one. Returns whether one was found.
+        """
+        levels = {
+            level: path
+            for level, path in self.cached_levels().items()
+            if self.iterations < level <= n
+        }
+        if not levels:
+            return False
+        level = max(levels)
+        opcodes = np.load(
+            levels[level], mmap_mode="r" if self.engine == Engine.MMAP else None
+        )
+        match self.engine:
+            case Engine.LIST:
+                self.system_value = self.decode(opcodes)
+            case Engine.ARRAY:
+                self.system_value = opcodes
+            case Engine.MMAP:
+                os.remove(self.system_value.filename)
+                self.system_value = self.write_level(level, [opcodes])
+            case Engine.COMPILED:
+                self.system_value = opcodes.tobytes()
+        self.iterations = level
+        return True
+
+    def save_checkpoint(self) -> None:
+        """Writes the current level to `self.cache_dir`, replacing shallower checkpoints"""
+        assert self.cache_dir is not None
+        os.makedirs(self.cache_dir, exist_ok=True)
+        stale = [
+            path
+            for level, path in self.cached_levels().items()
+            if level < self.iterations
+        ]
+        path = os.path.join(
+            self.cache_dir, f"{self.ruleset_key()}-{self.iterations}.npy"
+        )
+        match self.engine:
+            case Engine.LIST:
+                opcodes = self.encode(self.system_value)
+            case Engine.COMPILED:
+                opcodes = np.frombuffer(self.system_value, dtype=np.uint8)
+            case _:
+                opcodes = self.system_value
+        # write then rename, so an interrupted save never leaves a truncated checkpoint
+        with open(f"{path}.partial", "wb") as f:
+            np.save(f, opcodes)
+        os.replace(f"{path}.partial", path)
+        for stale_path in stale:
+            os.remove(stale_path)
+
+    @staticmethod
+    def run_length_encode(named_commands: Iterable[NamedCommand]) -> list[Run]:
+        """Groups consecutive identical named commands into runs"""
+        runs: list[Run] = []
+        for named in named_commands:
+            if runs and runs[-1][0] == named:
+                runs[-1] = (named, runs[-1][1] + 1)
+            else:
+                runs.append((named, 1))
+        return runs
+
+    def encode(self, named_commands: list[NamedCommand]) -> np.ndarray:
+        """Converts named commands to an opcode array"""
+        return np.array(
+            [self.opcodes[named] for named in named_commands], dtype=np.uint8
+        )
+
+    def decode(self, opcodes: np.ndarray) -> list[NamedCommand]:
+        """Converts an opcode array to named commands"""
+        return [self.alphabet[opcode] for opcode in opcodes.tolist()]
+
     @staticmethod
     def build_color_gradient(
         colors: Sequence[tuple[int, int, int]]
@@ -149,90 +1125,1676 @@ class LSystem:
 
         return gradient
 
-    def count_draws(self) -> int:
-        """Counts the number of draw commands that the system value will create.
-        Used for color interpolation
+    def commands(self) -> Iterable[Command]:
+        """Returns the commands of the current system value, whatever its storage"""
+        match self.engine:
+            case Engine.LIST:
+                return map(itemgetter(1), self.system_value)
+            case Engine.ARRAY | Engine.MMAP:
+                commands = [command for _, command in self.alphabet]
+                return chain.from_iterable(
+                    map(
+                        commands.__getitem__,
+                        self.system_value[i : i + DECODE_CHUNK_SIZE].tolist(),
+                    )
+                    for i in range(0, len(self.system_value), DECODE_CHUNK_SIZE)
+                )
+            case Engine.STREAM:
+                return self.stream_commands(self.system_value, self.iterations)
+            case Engine.RLE:
+                commands = [command for _, command in self.alphabet]
+                opcodes, counts = self.system_value
+                return chain.from_iterable(
+                    map(
+                        repeat,
+                        map(commands.__getitem__, opcodes.tolist()),
+                        counts.tolist(),
+                    )
+                )
+            case Engine.COMPILED:
+                commands = [command for _, command in self.alphabet]
+                return map(commands.__getitem__, self.system_value)
+
+    def stream_commands(
+        self, named_commands: list[NamedCommand], depth: int
+    ) -> Iterator[Command]:
+        """Yields the commands of `named_commands` iterated `depth` times, depth first.
+        Only a stack of pending (named command, remaining depth) pairs is kept in memory,
+        so memory grows with `depth` rather than with the length of the final level.
+        When pruning, symbols without effect on the drawing are dropped from the final level.
         """
-        pen_is_down = self.cursor.is_down
-        draws = 0
-        for _, command in self.system_value:
-            match command:
+        prune = self.prune
+        reversed_rules = {named: rule[::-1] for named, rule in self.rules.items()}
+        final_rules = reversed_rules
+        if prune:
+            final_rules = {
+                named: rule[::-1] for named, rule in self.pruned_rules().items()
+            }
+        stack = [(named, depth) for named in reversed(named_commands)]
+        while stack:
+            named, depth = stack.pop()
+            if depth and named in reversed_rules:
+                depth -= 1
+                rules = reversed_rules if depth else final_rules
+                stack.extend((child, depth) for child in rules[named])
+            elif not prune or named[1] != Command.NOACTION:
+                yield named[1]
+
+    def subtree_length(self, named: NamedCommand, depth: int) -> int:
+        """Returns the number of symbols `named` expands to when iterated `depth` times,
+        memoized per (symbol, depth)
+        """
+        key = (named, depth)
+        if key not in self.lengths:
+            if depth and named in self.rules:
+                self.lengths[key] = sum(
+                    self.subtree_length(child, depth - 1) for child in self.rules[named]
+                )
+            else:
+                self.lengths[key] = 1
+        return self.lengths[key]
+
+    def level_length(self, n: int | None = None) -> int:
+        """Returns the number of symbols of the `n`th level, the current level by default"""
+        n = self.iterations if n is None else n
+        return sum(self.subtree_length(named, n) for named in self.seed)
+
+    def subtree_stack_profile(self, named: NamedCommand, depth: int) -> StackProfile:
+        """Returns the stack profile of `named` iterated `depth` times, memoized per
+        (symbol, depth)
+        """
+        key = (named, depth)
+        if key not in self.stack_profiles:
+            if depth and named in self.rules:
+                profile = STACK_IDENTITY
+                for child in self.rules[named]:
+                    profile = profile.then(self.subtree_stack_profile(child, depth - 1))
+                self.stack_profiles[key] = profile
+            else:
+                self.stack_profiles[key] = LEAF_STACK_PROFILES.get(
+                    named[1], STACK_IDENTITY
+                )
+        return self.stack_profiles[key]
+
+    def level_stack_profile(self, n: int | None = None) -> StackProfile:
+        """Returns the stack profile of the `n`th level, the current level by default"""
+        n = self.iterations if n is None else n
+        profile = STACK_IDENTITY
+        for named in self.seed:
+            profile = profile.then(self.subtree_stack_profile(named, n))
+        return profile
+
+    def level_stack_depth(self, n: int | None = None) -> int:
+        """Returns the most cursors saved at once while running the `n`th level, the
+        current level by default, on top of the ones saved before it
+        """
+        return self.level_stack_profile(n).highest
+
+    def check_brackets(self, n: int) -> None:
+        """Raises a `ValueError` if running the `n`th level would restore more positions
+        than were stored before it or by it, without expanding the level
+        """
+        lowest = self.level_stack_profile(n).lowest
+        if len(self.saved_cursors) + lowest < 0:
+            raise ValueError(
+                f"Level {n} restores a position that was never stored: at its lowest it "
+                f"has restored {-lowest} more positions than it stored, with "
+                f"{len(self.saved_cursors)} stored beforehand"
+            )
+
+    def check_rule_brackets(self) -> None:
+        """Raises a `ValueError` naming the rules that do not close every bracket they
+        open, which the memoized subtree transforms and bounds need
+        """
+        unbalanced = []
+        for named, rule in self.rules.items():
+            profile = self.subtree_stack_profile(named, 1)
+            if profile.net or profile.lowest:
+                replacement = "".join(name for name, _ in rule)
+                unbalanced.append(f"{named[0]} -> {replacement}")
+        if unbalanced:
+            raise ValueError(
+                "Rules must close every bracket they open, unlike "
+                + ", ".join(unbalanced)
+            )
+
+    def iter_symbols(
+        self, start: int = 0, stop: int | None = None, n: int | None = None
+    ) -> Iterator[NamedCommand]:
+        """Yields the symbols `start` to `stop` of the `n`th level, the current level by default,
+        without expanding the level. Subtrees ending before `start` are skipped whole using
+        their memoized lengths, so reaching `start` takes one descent of the rule tree.
+        """
+        n = self.iterations if n is None else n
+        length = self.level_length(n)
+        stop = length if stop is None else min(stop, length)
+        stack = [(named, n) for named in reversed(self.seed)]
+        # position in the level of the first symbol of the subtree on top of the stack
+        position = 0
+        while stack and position < stop:
+            named, depth = stack.pop()
+            if position < start:
+                subtree_length = self.subtree_length(named, depth)
+                if position + subtree_length <= start:
+                    position += subtree_length
+                    continue
+            if depth and named in self.rules:
+                depth -= 1
+                stack.extend((child, depth) for child in reversed(self.rules[named]))
+            else:
+                yield named
+                position += 1
+
+    def symbol_at(self, i: int, n: int | None = None) -> NamedCommand:
+        """Returns the `i`th symbol of the `n`th level, the current level by default,
+        without expanding the level
+        """
+        if not 0 <= i < self.level_length(n):
+            raise IndexError(f"Level has no symbol {i}")
+        return next(self.iter_symbols(i, i + 1, n))
+
+    def level_path(self, level: int) -> str:
+        """Returns the file a memory mapped level is stored in.
+        Levels of the mmap engine go to disk, levels shared with worker processes to memory.
+        """
+        if self.level_dir is None:
+            if self.engine == Engine.MMAP:
+                parent_dir = self.storage_dir
+            else:
+                parent_dir = (
+                    SHARED_MEMORY_DIR if os.path.isdir(SHARED_MEMORY_DIR) else None
+                )
+            self.level_dir = tempfile.mkdtemp(prefix="lsystem-", dir=parent_dir)
+            weakref.finalize(self, shutil.rmtree, self.level_dir, ignore_errors=True)
+        return os.path.join(self.level_dir, f"level-{level}.bin")
+
+    def write_level(self, level: int, chunks: Iterable[np.ndarray]) -> np.ndarray:
+        """Writes the `level`th level, given as consecutive opcode chunks, sequentially to a
+        level file and memory maps it. Only one chunk needs to be in memory at a time.
+        """
+        path = self.level_path(level)
+        alphabet = json.dumps(self.alphabet).encode()
+        size = 0
+        with open(path, "wb") as f:
+            f.write(LEVEL_FILE_HEADER.pack(LEVEL_FILE_MAGIC, len(alphabet), size))
+            f.write(alphabet)
+            for chunk in chunks:
+                chunk.tofile(f)
+                size += len(chunk)
+            f.seek(0)
+            f.write(LEVEL_FILE_HEADER.pack(LEVEL_FILE_MAGIC, len(alphabet), size))
+        return self.read_level(path)
+
+    def read_level(self, path: str) -> np.ndarray:
+        """Memory maps the opcodes of a level file written by `write_level`"""
+        with open(path, "rb") as f:
+            magic, alphabet_size, size = LEVEL_FILE_HEADER.unpack(
+                f.read(LEVEL_FILE_HEADER.size)
+            )
+            alphabet = json.loads(f.read(alphabet_size))
+        if magic != LEVEL_FILE_MAGIC:
+            raise ValueError(f"{path} is not a level file")
+        if [tuple(named) for named in alphabet] != self.alphabet:
+            raise ValueError(f"{path} was written with another alphabet")
+        if size == 0:
+            return np.empty(0, dtype=np.uint8)
+        offset = LEVEL_FILE_HEADER.size + alphabet_size
+        return np.memmap(path, dtype=np.uint8, mode="r", offset=offset, shape=(size,))
+
+    def expand_opcodes_parallel(
+        self, level: np.ndarray, rule_lengths: np.ndarray, rule_table: np.ndarray
+    ) -> np.ndarray:
+        """Expands an opcode array with the given replacement tables in `self.jobs` worker
+        processes.
+        The level is split into chunks whose output offsets are known from their symbol
+        histograms, and each worker writes its chunk's expansion straight into a memory
+        mapped file holding the new level, so results come back joined and in order.
+        """
+        if isinstance(level, np.memmap):
+            level_path = level.filename
+        else:
+            level_path = self.level_path(self.iterations)
+            level.tofile(level_path)
+        bounds = np.linspace(0, len(level), self.jobs * CHUNKS_PER_JOB + 1).astype(
+            np.int64
+        )
+        sizes = [
+            int(
+                np.bincount(level[start:stop], minlength=len(self.alphabet))
+                @ rule_lengths
+            )
+            for start, stop in pairwise(bounds.tolist())
+        ]
+        new_bounds = np.cumsum([0] + sizes).tolist()
+        if new_bounds[-1] == 0:
+            return np.empty(0, dtype=np.uint8)
+        new_level_path = self.level_path(self.iterations + 1)
+        new_level = np.memmap(
+            new_level_path, dtype=np.uint8, mode="w+", shape=(new_bounds[-1],)
+        )
+        with ProcessPoolExecutor(self.jobs) as executor:
+            for _ in executor.map(
+                expand_opcodes_chunk,
+                repeat(level_path),
+                bounds[:-1].tolist(),
+                bounds[1:].tolist(),
+                repeat(new_level_path),
+                new_bounds[:-1],
+                new_bounds[1:],
+                repeat(rule_lengths),
+                repeat(rule_table),
+            ):
+                pass
+        # the old level stays readable through existing mappings
+        os.remove(level_path)
+        return new_level
+
+    def iterate_system_value(self, prune: bool = False) -> None:
+        """Iterates the system's value, modifying `self.system_value`.
+        With `prune`, symbols without effect on the drawing are dropped from the new level,
+        which must then be the final one.
+        """
+        if self.is_pruned:
+            raise ValueError("A pruned system value cannot be iterated")
+        rules = self.pruned_rules() if prune else self.rules
+        rule_lengths, rule_table = self.rule_lengths, self.rule_table
+        if prune and self.engine in (Engine.ARRAY, Engine.MMAP):
+            rule_lengths, rule_table = self.build_rule_table(rules)
+        match self.engine:
+            case Engine.LIST:
+                new_system_value: list[NamedCommand] = []
+                for named_command in self.system_value:
+                    if named_command in rules:
+                        new_system_value.extend(rules[named_command])
+                    else:
+                        new_system_value.append(named_command)
+                self.system_value = new_system_value
+            case Engine.ARRAY if (
+                self.jobs > 1 and len(self.system_value) >= PARALLEL_MIN_SYMBOLS
+            ):
+                self.system_value = self.expand_opcodes_parallel(
+                    self.system_value, rule_lengths, rule_table
+                )
+            case Engine.ARRAY:
+                self.system_value = expand_opcodes(
+                    self.system_value, rule_lengths, rule_table
+                )
+            case Engine.STREAM:
+                # expansion is deferred to `stream_commands`
+                pass
+            case Engine.RLE:
+                run_table = self.run_table
+                if prune:
+                    run_table = self.build_run_table(rules)
+                self.system_value = expand_runs(*self.system_value, *run_table)
+            case Engine.COMPILED:
+                compiled = self.compiled_ruleset(self.iterations + 1)
+                self.system_value = compiled.expand(
+                    self.system_value,
+                    compiled.PRUNED_REPLACEMENTS if prune else compiled.REPLACEMENTS,
+                )
+            case Engine.MMAP:
+                level = self.system_value
+                chunks = (
+                    level[i : i + MMAP_CHUNK_SIZE]
+                    for i in range(0, len(level), MMAP_CHUNK_SIZE)
+                )
+                self.system_value = self.write_level(
+                    self.iterations + 1,
+                    (expand_opcodes(c, rule_lengths, rule_table) for c in chunks),
+                )
+                if isinstance(level, np.memmap):
+                    os.remove(level.filename)
+        self.iterations += 1
+        # the stream engine prunes while streaming, leaving its seed intact
+        self.is_pruned = prune and self.engine != Engine.STREAM
+
+    def run_system_value(self) -> None:
+        """Updates the canvas and the cursor according to the current system value"""
+        if self.interpreter in (
+            Interpreter.VECTOR,
+            Interpreter.PARALLEL,
+            Interpreter.CULLED,
+            Interpreter.INSTANCED,
+        ):
+            self.rasterize(self.trace_system_value())
+        else:
+            self.interpret(self.line_drawer)
+
+    def trace_system_value(self) -> SegmentBuffer:
+        """Updates the cursor according to the current system value, recording the lines
+        it draws in a segment buffer instead of drawing them on the canvas
+        """
+        if self.interpreter == Interpreter.VECTOR:
+            return self.segment_buffer(*self.trace_vectorized(self.command_array()))
+        if self.interpreter == Interpreter.PARALLEL:
+            return self.trace_parallel()
+        if self.interpreter == Interpreter.CULLED:
+            return self.trace_culled()
+        if self.interpreter == Interpreter.INSTANCED:
+            return self.trace_culled(instance_symbols=INSTANCE_MAX_SYMBOLS)
+        lines = array("d")
+
+        def record(from_x: float, from_y: float, to_x: float, to_y: float):
+            lines.extend((from_x, from_y, to_x, to_y))
+
+        self.interpret(lambda _: record)
+        return self.segment_buffer(*np.frombuffer(lines).reshape(-1, 4).T)
+
+    def __getstate__(self) -> dict:
+        """Pickles the system without its canvas and materialized level, which worker
+        processes do not need; they expand the parts of the level they run from the seed
+        """
+        state = self.__dict__.copy()
+        for name in ("canvas", "canvas_draw", "gradient", "system_value"):
+            del state[name]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.gradient = LSystem.build_color_gradient(self.pen_colors)
+        self.canvas = Image.new("RGB", (1, 1), self.background_color)
+        self.canvas_draw = ImageDraw.Draw(self.canvas)
+        self.system_value = self.seed.copy()
+
+    def trace_parallel(self) -> SegmentBuffer:
+        """Traces the current level in `self.jobs` worker processes.
+        The level is split into chunks of equal numbers of symbols; the cursor and saved
+        cursors each chunk starts with are computed from the memoized subtree transforms
+        of the symbols before it, so chunks run independently and their lines are joined
+        in drawing order. The level is never expanded, whatever the engine.
+        Rules must close every bracket they open, as for `subtree_transform`.
+        """
+        self.check_rule_brackets()
+        length = self.level_length()
+        chunks = self.jobs * CHUNKS_PER_JOB
+        bounds = [length * k // chunks for k in range(chunks + 1)]
+        cursors = []
+        saved_cursors = []
+        for start in bounds:
+            transform, saved = self.prefix_state(start, self.iterations)
+            cursors.append(self.transform_cursor(transform))
+            saved_cursors.append(
+                self.saved_cursors + [self.transform_cursor(t) for t in saved]
+            )
+        with ProcessPoolExecutor(self.jobs) as executor:
+            lines = list(
+                executor.map(
+                    trace_chunk,
+                    repeat(self),
+                    bounds[:-1],
+                    bounds[1:],
+                    cursors[:-1],
+                    saved_cursors[:-1],
+                )
+            )
+        self.cursor = cursors[-1]
+        self.saved_cursors = saved_cursors[-1]
+        return self.segment_buffer(*np.concatenate(lines).T)
+
+    def trace_culled(
+        self, n: int | None = None, instance_symbols: int | None = None
+    ) -> SegmentBuffer:
+        """Traces the `n`th level, the current level by default, by walking its rule tree
+        from the seed, without expanding it. A subtree whose bounds miss the canvas is
+        jumped over by its transform, skipping the lines it would draw in the drawing
+        order, so the work done grows with the visible part of the drawing rather than
+        the whole of it. With a level of detail tolerance, a subtree whose bounds are
+        smaller than it is drawn as a single chord from its entry to its exit position
+        instead, so the work done grows with the canvas resolution rather than the depth
+        of the level. Subtrees of at most `instance_symbols` symbols are drawn by placing
+        their memoized `subtree_segments` with one affine transform each.
+        Rules must close every bracket they open, as for `subtree_transform`.
+        """
+        self.check_rule_brackets()
+        n = self.iterations if n is None else n
+        movement_length = self.movement_length
+        lod_tolerance = self.lod_tolerance
+        width, height = self.canvas_width, self.canvas_height
+        # lines outside the canvas by less than half the pen width, plus the pixel lost
+        # when coordinates are truncated, still show
+        reach = self.pen_thickness / 2 + 1
+        x, y, angle, is_down = astuple(self.cursor)
+        turns = 0
+        headings = self.heading_table(angle)
+        # bounds are for headings from angle zero, turned to the starting angle
+        c0, s0 = cos(angle), sin(angle)
+        size = self.level_stack_depth(n)
+        saved_x, saved_y, saved_turns, saved_is_down = allocate_turtle_stack(size)
+        top = 0
+        lines = array("d")
+        draws = array("q")
+        draw = 0
+        # lines of the instanced subtrees, and their positions in the drawing order
+        instances: list[np.ndarray] = []
+        instance_draws: list[np.ndarray] = []
+        # pending (named command, remaining depth, whether its bounds are on the canvas)
+        stack = [(named, n, False) for named in reversed(self.seed)]
+        while stack:
+            named, depth, inside = stack.pop()
+            if depth and named in self.rules:
+                is_outside = is_chord = False
+                if not inside or lod_tolerance is not None:
+                    min_x, min_y, max_x, max_y = rotate_bounds(
+                        self.subtree_bounds(named, depth, turns), c0, s0
+                    )
+                    left = x + movement_length * min_x - reach
+                    right = x + movement_length * max_x + reach
+                    upper = y - movement_length * max_y - reach
+                    lower = y - movement_length * min_y + reach
+                    is_outside = (
+                        right < 0 or left > width or lower < 0 or upper > height
+                    )
+                    is_chord = lod_tolerance is not None and (
+                        movement_length * max(max_x - min_x, max_y - min_y)
+                        < lod_tolerance
+                    )
+                    inside = (
+                        left >= 0 and right <= width and upper >= 0 and lower <= height
+                    )
+                is_instance = (
+                    instance_symbols is not None
+                    and self.subtree_length(named, depth) <= instance_symbols
+                )
+                if is_outside or is_chord or is_instance:
+                    transform = self.subtree_transform(named, depth)
+                    c, s = headings[turns]
+                    to_x = x + movement_length * (c * transform.dx - s * transform.dy)
+                    to_y = y - movement_length * (s * transform.dx + c * transform.dy)
+                    if is_outside:
+                        # nothing is drawn, the turtle only jumps
+                        pass
+                    elif is_chord:
+                        if transform.draws[is_down]:
+                            lines.extend((x, y, to_x, to_y))
+                            draws.append(draw)
+                    else:
+                        segments = self.subtree_segments(named, depth, is_down)
+                        local_x = segments[:, 0::2]
+                        local_y = segments[:, 1::2]
+                        placed = np.empty_like(segments)
+                        placed[:, 0::2] = x + c * local_x + s * local_y
+                        placed[:, 1::2] = y - s * local_x + c * local_y
+                        instances.append(placed)
+                        instance_draws.append(
+                            np.arange(draw, draw + len(segments), dtype=np.int64)
+                        )
+                    x = to_x
+                    y = to_y
+                    turns += transform.turns
+                    draw += transform.draws[is_down]
+                    is_down = transform.pen[is_down]
+                    continue
+                depth -= 1
+                stack.extend(
+                    (child, depth, inside) for child in reversed(self.rules[named])
+                )
+                continue
+            match named[1]:
                 case Command.PENDOWN:
-                    pen_is_down = True
+                    is_down = True
                 case Command.PENUP:
-                    pen_is_down = False
+                    is_down = False
                 case Command.MOVEFORWARD:
-                    if pen_is_down:
-                        draws += 1
+                    c, s = headings[turns]
+                    to_x = x + movement_length * c
+                    to_y = y - movement_length * s
+                    if is_down:
+                        lines.extend((x, y, to_x, to_y))
+                        draws.append(draw)
+                        draw += 1
+                    x = to_x
+                    y = to_y
+                case Command.ROTATECCW:
+                    turns += 1
+                case Command.ROTATECW:
+                    turns -= 1
+                case Command.STOREPOS:
+                    if top == size:
+                        size = grow_turtle_stack(
+                            saved_x, saved_y, saved_turns, saved_is_down
+                        )
+                    saved_x[top] = x
+                    saved_y[top] = y
+                    saved_turns[top] = turns
+                    saved_is_down[top] = is_down
+                    top += 1
                 case Command.GOTOPOS:
-                    if pen_is_down:
-                        draws += 1
+                    if top:
+                        top -= 1
+                        to_x = saved_x[top]
+                        to_y = saved_y[top]
+                        turns = saved_turns[top]
+                    else:
+                        saved_cursor = self.saved_cursors.pop()
+                        to_x = saved_cursor.x
+                        to_y = saved_cursor.y
+                        angle = saved_cursor.angle
+                        turns = 0
+                        headings = self.heading_table(angle)
+                        c0, s0 = cos(angle), sin(angle)
+                    if is_down:
+                        lines.extend((x, y, to_x, to_y))
+                        draws.append(draw)
+                        draw += 1
+                    x = to_x
+                    y = to_y
                 case _:
                     pass
-        return draws
-
-    def iterate_system_value(self) -> None:
-        """Iterates the system's value, modifying `self.system_value`"""
-        new_system_value: list[NamedCommand] = []
-        for named_command in self.system_value:
-            if named_command in self.rules:
-                new_system_value.extend(self.rules[named_command])
-            else:
-                new_system_value.append(named_command)
-        self.system_value = new_system_value
+        self.store_turtle(
+            x,
+            y,
+            angle,
+            turns,
+            is_down,
+            (saved_x, saved_y, saved_turns, saved_is_down),
+            top,
+        )
+        return self.segment_buffer(
+            *np.concatenate([np.frombuffer(lines).reshape(-1, 4)] + instances).T,
+            np.concatenate([np.frombuffer(draws, dtype=np.int64)] + instance_draws),
+            draw,
+        )
 
-    def run_system_value(self) -> None:
-        """Updates the canvas and the cursor according to the current system value"""
+    def subtree_segments(
+        self, named: NamedCommand, depth: int, is_down: bool
+    ) -> np.ndarray:
+        """Returns the lines `named` iterated `depth` times draws when run from the origin
+        facing angle zero with the pen `is_down`, one row of from x, from y, to x and
+        to y per line. Memoized per (symbol, depth, pen state, movement length).
+        """
+        key = (named, depth, is_down, self.movement_length)
+        if key not in self.segments:
+            lines = array("d")
+            cursor, saved_cursors = self.cursor, self.saved_cursors
+            self.cursor, self.saved_cursors = Cursor(0.0, 0.0, 0.0, is_down), []
+            try:
+                self.run_commands(
+                    self.stream_commands([named], depth),
+                    lambda *line: lines.extend(line),
+                )
+            finally:
+                self.cursor, self.saved_cursors = cursor, saved_cursors
+            self.segments[key] = np.frombuffer(lines).reshape(-1, 4)
+        return self.segments[key]
+
+    def interpret(self, line_sink: Callable[[int], DrawLine]) -> None:
+        """Runs the current system value with the loop interpreter, passing the lines it
+        draws to the function `line_sink` returns for the total number of lines.
+        The total is predicted from the memoized pen transducers before running.
+        """
+        total_draws = self.predict_draws()
+        if self.optimize:
+            self.run_instructions(self.optimized_instructions(), line_sink(total_draws))
+        elif self.engine == Engine.RLE:
+            commands = [command for _, command in self.alphabet]
+            opcodes, counts = self.system_value
+            instructions = zip(
+                map(commands.__getitem__, opcodes.tolist()), counts.tolist()
+            )
+            self.run_instructions(instructions, line_sink(total_draws))
+        elif self.engine == Engine.COMPILED:
+            compiled = self.compiled_ruleset()
+            compiled.run(self, self.system_value, line_sink(total_draws))
+        else:
+            self.run_commands(self.commands(), line_sink(total_draws))
+
+    def line_drawer(self, total_draws: int) -> DrawLine:
+        """Returns a function drawing `total_draws` lines on the canvas, colored in order
+        along the gradient
+        """
+        draws = 0
 
         def draw(from_x: float, from_y: float, to_x: float, to_y: float):
-            nonlocal draws, total_draws
             """Draws a line from (from_x, from_y) to (to_x, to_y)"""
+            nonlocal draws
             color = self.gradient(draws / total_draws)
             self.canvas_draw.line(
                 ((from_x, from_y), (to_x, to_y)),
                 fill=color,
                 width=self.pen_thickness,
             )
+            draws += 1
 
-        draws = 0
-        total_draws = self.count_draws()
-        for _, command in self.system_value:
+        return draw
+
+    def heading_table(self, angle: float) -> HeadingTable:
+        """Returns the headings reached from `angle` by the rotation angle, memoized"""
+        if angle not in self.heading_tables:
+            self.heading_tables[angle] = HeadingTable(angle, self.rotate_angle)
+        return self.heading_tables[angle]
+
+    def run_commands(self, commands: Iterable[Command], draw: DrawLine) -> None:
+        """Updates the cursor according to `commands`, passing the lines drawn to `draw`.
+        The turtle is kept in local variables with its heading as a number of turns from
+        `angle`, looked up in a `HeadingTable`, and saved cursors are written into
+        parallel lists preallocated for the deepest nesting of the level, so branching
+        allocates nothing.
+        """
+        movement_length = self.movement_length
+        x, y, angle, is_down = astuple(self.cursor)
+        turns = 0
+        headings = self.heading_table(angle)
+        size = self.level_stack_depth()
+        saved_x, saved_y, saved_turns, saved_is_down = allocate_turtle_stack(size)
+        top = 0
+        for command in commands:
             match command:
                 case Command.PENDOWN:
-                    self.cursor.is_down = True
+                    is_down = True
                 case Command.PENUP:
-                    self.cursor.is_down = False
+                    is_down = False
                 case Command.MOVEFORWARD:
-                    from_x = self.cursor.x
-                    from_y = self.cursor.y
-                    self.cursor.move_forward(self.movement_length)
-                    if self.cursor.is_down:
-                        to_x = self.cursor.x
-                        to_y = self.cursor.y
-                        draw(from_x, from_y, to_x, to_y)
-                        draws += 1
+                    c, s = headings[turns]
+                    to_x = x + movement_length * c
+                    to_y = y - movement_length * s
+                    if is_down:
+                        draw(x, y, to_x, to_y)
+                    x = to_x
+                    y = to_y
                 case Command.ROTATECCW:
-                    self.cursor.rotate_ccw(self.rotate_angle)
+                    turns += 1
                 case Command.ROTATECW:
-                    self.cursor.rotate_cw(self.rotate_angle)
+                    turns -= 1
                 case Command.STOREPOS:
-                    self.saved_cursors.append(self.cursor)
+                    if top == size:
+                        size = grow_turtle_stack(
+                            saved_x, saved_y, saved_turns, saved_is_down
+                        )
+                    saved_x[top] = x
+                    saved_y[top] = y
+                    saved_turns[top] = turns
+                    saved_is_down[top] = is_down
+                    top += 1
                 case Command.GOTOPOS:
-                    saved_cursor = self.saved_cursors.pop()
-                    if self.cursor.is_down:
-                        draw(
-                            self.cursor.x, self.cursor.y, saved_cursor.x, saved_cursor.y
+                    if top:
+                        top -= 1
+                        to_x = saved_x[top]
+                        to_y = saved_y[top]
+                        turns = saved_turns[top]
+                    else:
+                        # cursors saved before this run have their own angle
+                        saved_cursor = self.saved_cursors.pop()
+                        to_x = saved_cursor.x
+                        to_y = saved_cursor.y
+                        angle = saved_cursor.angle
+                        turns = 0
+                        headings = self.heading_table(angle)
+                    if is_down:
+                        draw(x, y, to_x, to_y)
+                    x = to_x
+                    y = to_y
+                case _:
+                    pass
+        self.store_turtle(
+            x,
+            y,
+            angle,
+            turns,
+            is_down,
+            (saved_x, saved_y, saved_turns, saved_is_down),
+            top,
+        )
+
+    def store_turtle(
+        self,
+        x: float,
+        y: float,
+        angle: float,
+        turns: int,
+        is_down: bool,
+        stack: TurtleStack,
+        top: int,
+    ) -> None:
+        """Writes the turtle kept in local variables by `run_commands` back to the cursor,
+        and the first `top` cursors of `stack` onto the saved cursors
+        """
+        self.cursor = Cursor(x, y, angle + turns * self.rotate_angle, is_down)
+        saved_x, saved_y, saved_turns, saved_is_down = stack
+        self.saved_cursors.extend(
+            Cursor(
+                saved_x[i],
+                saved_y[i],
+                angle + saved_turns[i] * self.rotate_angle,
+                saved_is_down[i],
+            )
+            for i in range(top)
+        )
+
+    def ruleset_source(self) -> str:
+        """Returns the source of a python module specialized to the rules and alphabet.
+        It defines the replacement of every opcode as a bytes literal, with and without
+        pruning, `expand` rewriting a level of opcodes once, and `run`, the loop of
+        `run_commands` with the action of each symbol inlined and dispatched on its
+        opcode.
+        """
+        opcodes = {
+            command: [
+                opcode
+                for opcode, named in enumerate(self.alphabet)
+                if named[1] == command
+            ]
+            for command in COMPILED_ACTIONS
+        }
+        pruned_rules = self.pruned_rules()
+
+        def condition(opcodes: list[int]) -> str:
+            return " or ".join(f"opcode == {opcode}" for opcode in opcodes)
+
+        source = [
+            f'"""Ruleset {self.ruleset_key()} compiled by `LSystem.ruleset_source`.',
+            "`allocate_turtle_stack` and `grow_turtle_stack` are provided by the loader.",
+            '"""',
+            "",
+        ]
+        for name, rules in (
+            ("REPLACEMENTS", self.rules),
+            ("PRUNED_REPLACEMENTS", pruned_rules),
+        ):
+            source.append(f"{name} = (")
+            for named in self.alphabet:
+                replacement = rules.get(named, [named])
+                text = "".join(child[0] for child in replacement)
+                opcodes_literal = bytes(self.opcodes[child] for child in replacement)
+                source.append(f"    {opcodes_literal!r},  # {named[0]!r} -> {text!r}")
+            source.append(")")
+        source += [
+            "",
+            "",
+            "def expand(level, replacements=REPLACEMENTS):",
+            "    return b''.join(map(replacements.__getitem__, level))",
+            "",
+            "",
+            "def run(lsystem, level, draw):",
+            "    movement_length = lsystem.movement_length",
+            "    x = lsystem.cursor.x",
+            "    y = lsystem.cursor.y",
+            "    angle = lsystem.cursor.angle",
+            "    is_down = lsystem.cursor.is_down",
+            "    turns = 0",
+            "    headings = lsystem.heading_table(angle)",
+            "    size = lsystem.level_stack_depth()",
+            "    saved_x, saved_y, saved_turns, saved_is_down = allocate_turtle_stack(size)",
+            "    top = 0",
+            "    for opcode in level:",
+        ]
+        keyword = "if"
+        for command, action in COMPILED_ACTIONS.items():
+            if opcodes[command]:
+                source.append(f"        {keyword} {condition(opcodes[command])}:")
+                source += [f"            {line}" for line in action]
+                keyword = "elif"
+        if keyword == "if":
+            source.append("        pass")
+        source += [
+            "    lsystem.store_turtle(",
+            "        x,",
+            "        y,",
+            "        angle,",
+            "        turns,",
+            "        is_down,",
+            "        (saved_x, saved_y, saved_turns, saved_is_down),",
+            "        top,",
+            "    )",
+            "",
+        ]
+        return "\n".join(source)
+
+    def compiled_ruleset(self, n: int | None = None) -> ModuleType:
+        """Returns the module generated by `ruleset_source`, compiled once per process
+        and checked by `verify_compiled` up to the `n`th level, the current level by
+        default. With a cache directory the source is written there and imported, so its
+        bytecode is cached across runs as well.
+        """
+        n = self.iterations if n is None else n
+        source = self.ruleset_source()
+        key = hashlib.sha256(source.encode()).hexdigest()
+        if key not in COMPILED_RULESETS:
+            name = f"lsystem_{key[:16]}"
+            helpers = {
+                "allocate_turtle_stack": allocate_turtle_stack,
+                "grow_turtle_stack": grow_turtle_stack,
+            }
+            if self.cache_dir is None:
+                module = ModuleType(name)
+                module.__dict__.update(helpers)
+                exec(compile(source, f"<{name}>", "exec"), module.__dict__)
+            else:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                path = os.path.join(self.cache_dir, f"{name}.py")
+                if not os.path.exists(path):
+                    with open(f"{path}.partial", "w") as f:
+                        f.write(source)
+                    os.replace(f"{path}.partial", path)
+                spec = importlib.util.spec_from_file_location(name, path)
+                assert spec is not None and spec.loader is not None
+                module = importlib.util.module_from_spec(spec)
+                module.__dict__.update(helpers)
+                spec.loader.exec_module(module)
+            COMPILED_RULESETS[key] = module
+            COMPILED_CHECKED_LEVELS[key] = -1
+        checked = COMPILED_CHECKED_LEVELS[key]
+        if checked is not None and checked < n:
+            complete = self.verify_compiled(COMPILED_RULESETS[key], n)
+            COMPILED_CHECKED_LEVELS[key] = None if complete else n
+        return COMPILED_RULESETS[key]
+
+    def verify_compiled(self, compiled: ModuleType, n: int) -> bool:
+        """Checks a compiled ruleset against the rules and the loop interpreter on every
+        level up to the `n`th of at most `COMPILE_CHECK_SYMBOLS` symbols, raising a
+        `RuntimeError` if it expands a level or draws a line differently. Levels whose
+        brackets cannot be run are only checked for their expansion.
+        Returns whether the levels stopped growing or got too long before the `n`th.
+        """
+
+        def lines_drawn(run: Callable[[DrawLine], None]) -> array:
+            lines = array("d")
+            self.cursor, self.saved_cursors = Cursor(0.0, 0.0, 0.0, True), []
+            run(lambda *line: lines.extend(line))
+            return lines
+
+        named_level = self.seed
+        level = self.encode(self.seed).tobytes()
+        cursor, saved_cursors = self.cursor, self.saved_cursors
+        try:
+            # stop once levels stop growing, so rules that never grow still terminate
+            for k in range(n + 1):
+                if level != self.encode(named_level).tobytes():
+                    raise RuntimeError("Compiled ruleset expands a level differently")
+                if self.level_stack_profile(k).lowest >= 0:
+                    expected = lines_drawn(
+                        lambda draw: self.run_commands(
+                            map(itemgetter(1), named_level), draw
                         )
-                        draws += 1
-                    saved_cursor.is_down = self.cursor.is_down
-                    self.cursor = saved_cursor
+                    )
+                    actual = lines_drawn(lambda draw: compiled.run(self, level, draw))
+                    if expected != actual:
+                        raise RuntimeError("Compiled ruleset draws a level differently")
+                next_level = compiled.expand(level)
+                if not len(level) < len(next_level) <= COMPILE_CHECK_SYMBOLS:
+                    return True
+                level = next_level
+                named_level = [
+                    child
+                    for named in named_level
+                    for child in self.rules.get(named, [named])
+                ]
+        finally:
+            self.cursor, self.saved_cursors = cursor, saved_cursors
+        return False
+
+    def subtree_instructions(
+        self, named: NamedCommand, depth: int, is_down: bool
+    ) -> list[Instruction]:
+        """Returns the optimized instructions of `named` iterated `depth` times, run from
+        pen state `is_down`, memoized per (symbol, depth, pen state).
+        Only for subtrees that close every bracket they open.
+        """
+        key = (named, depth, is_down)
+        if key not in self.optimized_subtrees:
+            optimizer = PeepholeOptimizer(is_down)
+            if depth and named in self.rules:
+                settled = list(
+                    self.optimize_subtrees(optimizer, self.rules[named], depth - 1)
+                )
+                settled.extend(optimizer.finish())
+            else:
+                optimizer.add(named[1], 1)
+                settled = optimizer.finish()
+            self.optimized_subtrees[key] = settled
+        return self.optimized_subtrees[key]
+
+    def optimize_subtrees(
+        self,
+        optimizer: PeepholeOptimizer,
+        named_commands: list[NamedCommand],
+        depth: int,
+    ) -> Iterator[Instruction]:
+        """Adds `named_commands` iterated `depth` times to `optimizer`, depth first,
+        yielding the instructions it settles along the way. Subtrees of at most
+        `OPTIMIZE_MAX_SYMBOLS` symbols closing every bracket they open are added as their
+        memoized `subtree_instructions`, so the optimizer does not visit their symbols.
+        """
+        stack = [(named, depth) for named in reversed(named_commands)]
+        while stack:
+            named, depth = stack.pop()
+            if depth and named in self.rules:
+                profile = self.subtree_stack_profile(named, depth)
+                if (profile.net or profile.lowest) or self.subtree_length(
+                    named, depth
+                ) > OPTIMIZE_MAX_SYMBOLS:
+                    depth -= 1
+                    stack.extend(
+                        (child, depth) for child in reversed(self.rules[named])
+                    )
+                    continue
+                is_down = optimizer.is_down
+                transducer = self.subtree_pen_transducer(named, depth)
+                optimizer.add_chunk(
+                    self.subtree_instructions(named, depth, is_down),
+                    transducer.draws[is_down],
+                    transducer.pen[is_down],
+                )
+            else:
+                optimizer.add(named[1], 1)
+            if len(optimizer.optimized) >= OPTIMIZE_SETTLE_SIZE:
+                yield from optimizer.settle()
+
+    def optimized_instructions(self) -> Iterator[Instruction]:
+        """Yields the current level rewritten into fewer instructions that draw the same
+        lines by a `PeepholeOptimizer`, walking the rule tree from the seed without
+        expanding the level. Sets `self.eliminated_instructions` to the number of symbols
+        in the level minus the number of instructions yielded, once all are yielded.
+        """
+        optimizer = PeepholeOptimizer(self.cursor.is_down)
+        yield from self.optimize_subtrees(optimizer, self.seed, self.iterations)
+        yield from optimizer.finish()
+        symbols = self.level_length()
+        if self.prune:
+            symbols -= self.pruned_symbols
+        self.eliminated_instructions = symbols - optimizer.settled
+
+    def command_array(self) -> np.ndarray:
+        """Returns the commands of the current system value as an array of `Command` values"""
+        if self.engine in (Engine.ARRAY, Engine.MMAP, Engine.COMPILED):
+            commands = np.array(
+                [command for _, command in self.alphabet], dtype=np.uint8
+            )
+            if self.engine == Engine.COMPILED:
+                return commands[np.frombuffer(self.system_value, dtype=np.uint8)]
+            return commands[self.system_value]
+        if self.engine == Engine.RLE:
+            opcodes, counts = self.system_value
+            commands = np.array(
+                [command for _, command in self.alphabet], dtype=np.uint8
+            )
+            return np.repeat(commands[opcodes], counts)
+        return np.fromiter(self.commands(), dtype=np.uint8)
+
+    def trace_vectorized(self, commands: np.ndarray) -> tuple[np.ndarray, ...]:
+        """Computes the lines running `commands`, an array of `Command` values, draws,
+        using whole array operations instead of a loop over the commands.
+        Headings and positions are cumulative sums of rotations and steps, in which each `]`
+        adds back what was accumulated at its branch's depth since the matching `[`.
+        Those per depth sums come from one scan over the commands stably sorted by depth,
+        in which matching brackets are next to each other.
+        Moves the cursor and saved cursors as running the commands would.
+        Returns the from x, from y, to x and to y of every line, in drawing order.
+        """
+        # pen state each command runs with
+        is_pen = (commands == Command.PENDOWN) | (commands == Command.PENUP)
+        last_pen = np.maximum.accumulate(np.where(is_pen, np.arange(len(commands)), -1))
+        pen = np.where(
+            last_pen >= 0, commands[last_pen] == Command.PENDOWN, self.cursor.is_down
+        )
+        is_down = bool(pen[-1]) if len(pen) else self.cursor.is_down
+        # only moves, rotations and brackets affect the geometry
+        moving = [
+            Command.MOVEFORWARD,
+            Command.ROTATECCW,
+            Command.ROTATECW,
+            Command.STOREPOS,
+            Command.GOTOPOS,
+        ]
+        kept = np.isin(commands, moving)
+        commands = commands[kept]
+        pen = pen[kept]
+        is_open = commands == Command.STOREPOS
+        is_close = commands == Command.GOTOPOS
+        depth = np.cumsum(is_open.astype(np.int64) - is_close)
+        if len(depth) and depth.min() < 0:
+            raise ValueError("Position restored without a stored position")
+        # brackets belong to the depth inside them; a stable sort by depth is a radix sort
+        level_depth = depth + is_close
+        level_depth = level_depth.astype(
+            np.uint16 if depth.max(initial=0) < 0xFFFF else np.int64
+        )
+        order = np.argsort(level_depth, kind="stable")
+        brackets = order[(is_open | is_close)[order]]
+        closes = np.flatnonzero(is_close[brackets])
+        close_at = brackets[closes]
+        open_at = brackets[closes - 1]
+
+        def restoring_cumsum(values: np.ndarray) -> np.ndarray:
+            """Cumulative sum of `values` that returns to its value at each `[` on the `]`"""
+            level_sums = np.empty_like(values)
+            level_sums[order] = np.cumsum(values[order])
+            values = values.copy()
+            values[close_at] = level_sums[open_at] - level_sums[close_at]
+            return np.cumsum(values)
+
+        turns = restoring_cumsum(
+            (commands == Command.ROTATECCW).astype(np.int64)
+            - (commands == Command.ROTATECW)
+        )
+        angles = self.cursor.angle + turns * self.rotate_angle
+        c, s = self.heading_table(self.cursor.angle).vectors_of(turns)
+        is_move = commands == Command.MOVEFORWARD
+        x = self.cursor.x + restoring_cumsum(
+            np.where(is_move, self.movement_length * c, 0.0)
+        )
+        y = self.cursor.y - restoring_cumsum(
+            np.where(is_move, self.movement_length * s, 0.0)
+        )
+        from_x = np.concatenate(([self.cursor.x], x[:-1]))
+        from_y = np.concatenate(([self.cursor.y], y[:-1]))
+        drawn = (is_move | is_close) & pen
+
+        unclosed = np.setdiff1d(np.flatnonzero(is_open), open_at)
+        self.saved_cursors.extend(
+            Cursor(x[i], y[i], angles[i], bool(pen[i])) for i in unclosed.tolist()
+        )
+        if len(commands):
+            self.cursor = Cursor(float(x[-1]), float(y[-1]), float(angles[-1]), is_down)
+        self.cursor.is_down = is_down
+        return from_x[drawn], from_y[drawn], x[drawn], y[drawn]
+
+    def gradient_colors(self, t: np.ndarray) -> np.ndarray:
+        """Finds the colors at every f(t) along the gradient, packed as 0xRRGGBB.
+        Computes the same colors as `self.gradient` with the same operations on arrays.
+        """
+        colors = np.array(self.pen_colors, dtype=np.float64)
+        if len(colors) == 1:
+            rgb = np.broadcast_to(colors[0], (len(t), 3))
+        else:
+            t = np.clip(t, 0.0, 1.0)
+            n = len(colors) - 1
+            x = t * n
+            i = np.floor(x).astype(np.int64)
+            j = np.ceil(x).astype(np.int64)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                scaled_t = (t - i / n) / (j / n - i / n)
+            rgb = colors[i] + scaled_t[:, np.newaxis] * (colors[j] - colors[i])
+            rgb = np.where((i == j)[:, np.newaxis], colors[i], rgb)
+        rgb = rgb.astype(np.uint32)
+        return rgb[:, 0] << 16 | rgb[:, 1] << 8 | rgb[:, 2]
+
+    def segment_buffer(
+        self,
+        from_x: np.ndarray,
+        from_y: np.ndarray,
+        to_x: np.ndarray,
+        to_y: np.ndarray,
+        draw: np.ndarray | None = None,
+        total_draws: int | None = None,
+    ) -> SegmentBuffer:
+        """Builds the segment buffer of lines given by their endpoints in drawing order,
+        drawn with the current pen and colored in order along the gradient.
+        When only some of the lines drawn are given, `draw` holds their positions among
+        the `total_draws` lines.
+        """
+        if draw is None:
+            draw = np.arange(len(from_x), dtype=np.int64)
+        if total_draws is None:
+            total_draws = len(draw)
+        return SegmentBuffer(
+            np.ascontiguousarray(from_x, dtype=np.float64),
+            np.ascontiguousarray(from_y, dtype=np.float64),
+            np.ascontiguousarray(to_x, dtype=np.float64),
+            np.ascontiguousarray(to_y, dtype=np.float64),
+            draw,
+            np.full(len(draw), self.pen_thickness, dtype=np.uint16),
+            self.gradient_colors(draw / total_draws),
+        )
+
+    def rasterize(self, segments: SegmentBuffer) -> None:
+        """Draws the lines of a segment buffer on the canvas, in drawing order"""
+        order = np.argsort(segments.draw, kind="stable")
+        columns = (
+            segments.from_x,
+            segments.from_y,
+            segments.to_x,
+            segments.to_y,
+            segments.width,
+            segments.color,
+        )
+        for x0, y0, x1, y1, width, color in zip(
+            *(column[order].tolist() for column in columns)
+        ):
+            self.canvas_draw.line(
+                ((x0, y0), (x1, y1)),
+                fill=(color >> 16, color >> 8 & 0xFF, color & 0xFF),
+                width=width,
+            )
+
+    def run_instructions(
+        self, instructions: Iterable[Instruction], draw: DrawLine
+    ) -> None:
+        """Updates the cursor according to `instructions`, each of which is a command
+        repeated a number of times, passing the lines drawn to `draw`. Draws the same lines
+        as running every repetition one by one, but dispatches once per instruction.
+        The turtle and its saved cursors are kept as in `run_commands`.
+        """
+        movement_length = self.movement_length
+        x, y, angle, is_down = astuple(self.cursor)
+        turns = 0
+        headings = self.heading_table(angle)
+        size = self.level_stack_depth()
+        saved_x, saved_y, saved_turns, saved_is_down = allocate_turtle_stack(size)
+        top = 0
+        for command, count in instructions:
+            match command:
+                case Command.PENDOWN:
+                    is_down = True
+                case Command.PENUP:
+                    is_down = False
+                case Command.MOVEFORWARD | Command.JUMP:
+                    c, s = headings[turns]
+                    step_x = movement_length * c
+                    step_y = movement_length * s
+                    if command == Command.JUMP or not is_down:
+                        x += count * step_x
+                        y -= count * step_y
+                    else:
+                        for _ in range(count):
+                            draw(x, y, x + step_x, y - step_y)
+                            x += step_x
+                            y -= step_y
+                case Command.ROTATECCW:
+                    turns += count
+                case Command.ROTATECW:
+                    turns -= count
+                case Command.STOREPOS:
+                    for _ in range(count):
+                        if top == size:
+                            size = grow_turtle_stack(
+                                saved_x, saved_y, saved_turns, saved_is_down
+                            )
+                        saved_x[top] = x
+                        saved_y[top] = y
+                        saved_turns[top] = turns
+                        saved_is_down[top] = is_down
+                        top += 1
+                case Command.GOTOPOS:
+                    for _ in range(count):
+                        if top:
+                            top -= 1
+                            to_x = saved_x[top]
+                            to_y = saved_y[top]
+                            turns = saved_turns[top]
+                        else:
+                            saved_cursor = self.saved_cursors.pop()
+                            to_x = saved_cursor.x
+                            to_y = saved_cursor.y
+                            angle = saved_cursor.angle
+                            turns = 0
+                            headings = self.heading_table(angle)
+                        if is_down:
+                            draw(x, y, to_x, to_y)
+                        x = to_x
+                        y = to_y
                 case _:
                     pass
+        self.store_turtle(
+            x,
+            y,
+            angle,
+            turns,
+            is_down,
+            (saved_x, saved_y, saved_turns, saved_is_down),
+            top,
+        )
+
+    def apply_symbol(
+        self,
+        transform: Transform,
+        saved: list[Transform],
+        named: NamedCommand,
+        depth: int,
+    ) -> Transform:
+        """Returns `transform` followed by `named` iterated `depth` times.
+        Brackets that are not rewritten push to and pop from `saved`.
+        """
+        if depth == 0 or named not in self.rules:
+            match named[1]:
+                case Command.STOREPOS:
+                    saved.append(transform)
+                    return transform
+                case Command.GOTOPOS:
+                    if not saved:
+                        raise ValueError(f"Unbalanced {named[0]}")
+                    return transform.restore(saved.pop())
+        return transform.then(
+            self.subtree_transform(named, depth), self.heading_table(0.0)
+        )
+
+    def compose_transforms(
+        self, named_commands: list[NamedCommand], depth: int, balanced: bool = True
+    ) -> Transform:
+        """Composes the transforms of `named_commands`, each iterated `depth` times.
+        Brackets are matched inside the sequence; with `balanced` every `[` must be closed.
+        """
+        transform = IDENTITY
+        saved: list[Transform] = []
+        for named in named_commands:
+            transform = self.apply_symbol(transform, saved, named, depth)
+        if balanced and saved:
+            names = "".join(name for name, _ in named_commands)
+            raise ValueError(f"Unbalanced brackets in {names}")
+        return transform
+
+    def prefix_state(self, i: int, n: int) -> tuple[Transform, list[Transform]]:
+        """Returns the transform of the first `i` symbols of the `n`th level, and the
+        transforms saved by their unclosed brackets, without running or expanding them.
+        Subtrees ending before `i` are applied whole, so this takes one descent of the
+        rule tree.
+        """
+        transform = IDENTITY
+        saved: list[Transform] = []
+        stack = [(named, n) for named in reversed(self.seed)]
+        position = 0
+        while stack and position < i:
+            named, depth = stack.pop()
+            length = self.subtree_length(named, depth)
+            if position + length <= i:
+                transform = self.apply_symbol(transform, saved, named, depth)
+                position += length
+            else:
+                depth -= 1
+                stack.extend((child, depth) for child in reversed(self.rules[named]))
+        return transform, saved
+
+    def subtree_pen_transducer(self, named: NamedCommand, depth: int) -> PenTransducer:
+        """Returns the pen transducer of `named` iterated `depth` times, memoized per
+        (symbol, depth). Unlike transforms, these exist whatever the brackets do.
+        """
+        key = (named, depth)
+        if key not in self.pen_transducers:
+            if depth and named in self.rules:
+                transducer = PEN_IDENTITY
+                for child in self.rules[named]:
+                    transducer = transducer.then(
+                        self.subtree_pen_transducer(child, depth - 1)
+                    )
+                self.pen_transducers[key] = transducer
+            else:
+                self.pen_transducers[key] = LEAF_PEN_TRANSDUCERS.get(
+                    named[1], PEN_IDENTITY
+                )
+        return self.pen_transducers[key]
+
+    def level_pen_transducer(self, n: int | None = None) -> PenTransducer:
+        """Returns the pen transducer of the `n`th level, the current level by default"""
+        n = self.iterations if n is None else n
+        transducer = PEN_IDENTITY
+        for named in self.seed:
+            transducer = transducer.then(self.subtree_pen_transducer(named, n))
+        return transducer
+
+    def subtree_transform(self, named: NamedCommand, depth: int) -> Transform:
+        """Returns the transform of `named` iterated `depth` times, memoized per (symbol, depth).
+        Every occurrence of the subtree moves the cursor the same way relative to its
+        starting position and heading, so each entry is composed once from the entries
+        of its replacement one level down.
+        """
+        key = (named, depth)
+        if key not in self.transforms:
+            if depth and named in self.rules:
+                self.transforms[key] = self.compose_transforms(
+                    self.rules[named], depth - 1
+                )
+            elif named[1] in LEAF_TRANSFORMS:
+                self.transforms[key] = LEAF_TRANSFORMS[named[1]]
+            else:
+                raise ValueError(f"{named[0]} is not balanced on its own")
+        return self.transforms[key]
+
+    def level_transform(self, n: int | None = None) -> Transform:
+        """Returns the transform of the `n`th level, the current level by default"""
+        n = self.iterations if n is None else n
+        return self.compose_transforms(self.seed, n, balanced=False)
+
+    def final_cursor(self, n: int | None = None) -> Cursor:
+        """Predicts the cursor after running the `n`th level, without running it"""
+        return self.transform_cursor(self.level_transform(n))
+
+    def transform_cursor(self, transform: Transform) -> Cursor:
+        """Returns the cursor resulting from applying `transform` to the current cursor"""
+        c = cos(self.cursor.angle)
+        s = sin(self.cursor.angle)
+        return Cursor(
+            self.cursor.x
+            + self.movement_length * (c * transform.dx - s * transform.dy),
+            self.cursor.y
+            - self.movement_length * (s * transform.dx + c * transform.dy),
+            self.cursor.angle + transform.turns * self.rotate_angle,
+            transform.pen[self.cursor.is_down],
+        )
+
+    def subtree_bounds(self, named: NamedCommand, depth: int, turns: int) -> Bounds:
+        """Returns the bounds of every position `named` iterated `depth` times passes
+        through when started at the origin, `turns` rotations from angle zero, in units
+        of the movement length with y pointing up. Memoized per (symbol, depth, heading),
+        so they are exact whatever the rotation angle.
+        """
+        headings = self.heading_table(0.0)
+        if headings.count is not None:
+            turns %= headings.count
+        key = (named, depth, turns)
+        if key not in self.heading_bounds:
+            if depth and named in self.rules:
+                self.heading_bounds[key] = self.compose_bounds(
+                    self.rules[named], depth - 1, turns
+                )
+            elif named[1] == Command.MOVEFORWARD:
+                c, s = headings[turns]
+                self.heading_bounds[key] = (
+                    min(c, 0.0),
+                    min(s, 0.0),
+                    max(c, 0.0),
+                    max(s, 0.0),
+                )
+            else:
+                self.heading_bounds[key] = (0.0, 0.0, 0.0, 0.0)
+        return self.heading_bounds[key]
+
+    def compose_bounds(
+        self, named_commands: list[NamedCommand], depth: int, turns: int
+    ) -> Bounds:
+        """Returns the bounds of `named_commands`, each iterated `depth` times, as for
+        `subtree_bounds`. Each symbol's bounds are offset by the position the transforms
+        of the symbols before it lead to.
+        """
+        headings = self.heading_table(0.0)
+        transform = IDENTITY
+        saved: list[Transform] = []
+        min_x = min_y = max_x = max_y = 0.0
+        for named in named_commands:
+            c, s = headings[turns]
+            x = c * transform.dx - s * transform.dy
+            y = s * transform.dx + c * transform.dy
+            bounds = self.subtree_bounds(named, depth, turns + transform.turns)
+            min_x = min(min_x, x + bounds[0])
+            min_y = min(min_y, y + bounds[1])
+            max_x = max(max_x, x + bounds[2])
+            max_y = max(max_y, y + bounds[3])
+            transform = self.apply_symbol(transform, saved, named, depth)
+        return min_x, min_y, max_x, max_y
+
+    def unit_drawing_bounds(self, n: int | None = None) -> Bounds:
+        """Returns the bounds of the `n`th level, the current level by default, relative to
+        the cursor, in units of the movement length with y pointing up
+        """
+        self.check_rule_brackets()
+        n = self.iterations if n is None else n
+        return rotate_bounds(
+            self.compose_bounds(self.seed, n, 0),
+            cos(self.cursor.angle),
+            sin(self.cursor.angle),
+        )
+
+    def drawing_bounds(self, n: int | None = None) -> Bounds:
+        """Predicts the canvas area, as min x, min y, max x, max y, that the cursor passes
+        through when running the `n`th level, without running it
+        """
+        min_x, min_y, max_x, max_y = self.unit_drawing_bounds(n)
+        return (
+            self.cursor.x + self.movement_length * min_x,
+            self.cursor.y - self.movement_length * max_y,
+            self.cursor.x + self.movement_length * max_x,
+            self.cursor.y - self.movement_length * min_y,
+        )
+
+    def fitted_movement_length(self, n: int, margin: int) -> float:
+        """Returns the movement length with which the drawing of the `n`th level fills
+        the canvas but for `margin` pixels on each side, without running or expanding it.
+        Drawings without extent keep the current movement length.
+        """
+        min_x, min_y, max_x, max_y = self.unit_drawing_bounds(n)
+        # the pen reaches half its thickness past the lines' ends
+        room_x = self.canvas_width - 2 * margin - self.pen_thickness
+        room_y = self.canvas_height - 2 * margin - self.pen_thickness
+        if room_x <= 0 or room_y <= 0:
+            raise ValueError(f"A margin of {margin} leaves no room on the canvas")
+        scales = [
+            room / extent
+            for room, extent in ((room_x, max_x - min_x), (room_y, max_y - min_y))
+            if extent > 0
+        ]
+        return min(scales, default=self.movement_length)
+
+    def autofit(self, n: int, margin: int) -> None:
+        """Sets the movement length and the cursor's position so that the drawing of the
+        `n`th level is centered on the canvas and fills it but for `margin` pixels on
+        each side, without running or expanding the level
+        """
+        self.movement_length = self.fitted_movement_length(n, margin)
+        min_x, min_y, max_x, max_y = self.unit_drawing_bounds(n)
+        self.cursor.x = (
+            self.canvas_width / 2 - self.movement_length * (min_x + max_x) / 2
+        )
+        self.cursor.y = (
+            self.canvas_height / 2 + self.movement_length * (min_y + max_y) / 2
+        )
+
+    def scratch_copy(self) -> "LSystem":
+        """Returns a copy of the system at level zero with the same settings and cursor,
+        drawing on a canvas of its own and writing no checkpoints
+        """
+        scratch = LSystem(
+            self.seed,
+            self.rules,
+            self.canvas_width,
+            self.canvas_height,
+            background_color=self.background_color,
+            pen_colors=self.pen_colors,
+            movement_length=self.movement_length,
+            pen_thickness=self.pen_thickness,
+            rotate_angle=self.rotate_angle,
+            engine=self.engine,
+            jobs=self.jobs,
+            storage_dir=self.storage_dir,
+            prune=self.prune,
+            optimize=self.optimize,
+            interpreter=self.interpreter,
+            lod_tolerance=self.lod_tolerance,
+        )
+        scratch.cursor = replace(self.cursor)
+        return scratch
+
+    def calibrate_cost_model(self) -> CostModel:
+        """Measures a cost model by expanding and tracing the deepest level of at most
+        `CALIBRATION_SYMBOLS` symbols on a `scratch_copy`, with this system's engine,
+        interpreter and optimizer, then drawing the lines traced as they would be drawn.
+        Both are repeated until `CALIBRATION_SYMBOLS` symbols or lines, or
+        `CALIBRATION_SECONDS`, are measured, so that levels of a few symbols are not timed
+        from a single short run. The cost per symbol is the difference in time from the
+        level before over the difference in symbols, so that the time every run takes
+        whatever its length is not spread over the few symbols of such a short level.
+        The parallel interpreter is timed as the loop interpreter with its time split
+        between `jobs` processes, since starting worker processes would take longer than
+        running a level this short.
+        """
+        n = 0
+        while (
+            n < MAX_AUTO_DEPTH
+            and self.level_length(n) < self.level_length(n + 1) <= CALIBRATION_SYMBOLS
+        ):
+            n += 1
+
+        def seconds_per_run(k: int) -> tuple[float, LSystem, SegmentBuffer]:
+            symbols = self.level_length(k)
+            runs = 0
+            seconds = 0.0
+            # copying the system is not timed, but counts toward the time spent
+            deadline = time.perf_counter() + CALIBRATION_SECONDS
+            while True:
+                scratch = self.scratch_copy()
+                if scratch.interpreter == Interpreter.PARALLEL:
+                    scratch.interpreter = Interpreter.LOOP
+                start = time.perf_counter()
+                scratch.iterate_to(k)
+                segments = scratch.trace_system_value()
+                seconds += time.perf_counter() - start
+                runs += 1
+                if (
+                    runs * symbols >= CALIBRATION_SYMBOLS
+                    or time.perf_counter() >= deadline
+                ):
+                    return seconds / runs, scratch, segments
+
+        # an untimed run first, so that one-time setup is not counted
+        scratch = self.scratch_copy()
+        scratch.iterate_to(n)
+        scratch.trace_system_value()
+        seconds, scratch, segments = seconds_per_run(n)
+        symbols = self.level_length(n)
+        if n and self.level_length(n - 1) < symbols:
+            shorter_seconds, _, _ = seconds_per_run(n - 1)
+            seconds_per_symbol = max(seconds - shorter_seconds, 0.0) / (
+                symbols - self.level_length(n - 1)
+            )
+        else:
+            # a level without symbols costs nothing however deep
+            seconds_per_symbol = seconds / symbols if symbols else 0.0
+        seconds_per_symbol /= self.jobs
+        lines = 0
+        seconds = 0.0
+        if self.interpreter in (Interpreter.LOOP, Interpreter.PARALLEL) or not segments:
+            # lines are drawn one at a time along the gradient by `line_drawer`
+            draw = scratch.line_drawer(CALIBRATION_SYMBOLS)
+            x, y = self.canvas_width / 2, self.canvas_height / 2
+            headings = self.heading_table(0.0)
+            start = time.perf_counter()
+            while lines < CALIBRATION_SYMBOLS and seconds < CALIBRATION_SECONDS:
+                c, s = headings[lines]
+                draw(x, y, x + self.movement_length * c, y - self.movement_length * s)
+                lines += 1
+                seconds = time.perf_counter() - start
+        else:
+            while lines < CALIBRATION_SYMBOLS and seconds < CALIBRATION_SECONDS:
+                start = time.perf_counter()
+                scratch.rasterize(segments)
+                seconds += time.perf_counter() - start
+                lines += len(segments)
+        seconds_per_line = seconds / lines
+        return CostModel(seconds_per_symbol, seconds_per_line)
+
+    def choose_depth(
+        self,
+        time_budget: float | None = None,
+        min_segment: float | None = None,
+        margin: int | None = None,
+    ) -> DepthChoice:
+        """Returns the deepest level predicted to render within `time_budget` seconds
+        with lines at least `min_segment` pixels long, from the closed form level
+        lengths and line counts and a calibrated cost model, without expanding any level.
+        With a `margin`, line lengths are those `autofit` would choose for each level.
+        """
+        cost_model = self.calibrate_cost_model()
+
+        def describe(n: int) -> DepthChoice:
+            symbols = self.level_length(n)
+            lines = self.predict_draws(n)
+            segment_length = (
+                self.movement_length
+                if margin is None
+                else self.fitted_movement_length(n, margin)
+            )
+            reasons = []
+            seconds = cost_model.predict(symbols, lines)
+            if time_budget is not None and seconds > time_budget:
+                reasons.append(
+                    f"would take {seconds:.1f}s, more than the {time_budget}s budget"
+                )
+            if min_segment is not None and segment_length < min_segment:
+                reasons.append(
+                    f"would draw {segment_length:.2f} pixel lines, shorter than "
+                    f"{min_segment} pixels"
+                )
+            reason = f"level {n} " + " and ".join(reasons) if reasons else ""
+            return DepthChoice(n, symbols, lines, seconds, segment_length, reason)
+
+        choice = describe(0)
+        for n in range(1, MAX_AUTO_DEPTH + 1):
+            deeper = describe(n)
+            if deeper.reason:
+                return replace(choice, reason=deeper.reason)
+            choice = deeper
+        return replace(
+            choice, reason=f"it is the deepest level considered, {MAX_AUTO_DEPTH}"
+        )
+
+    def zoom(self, center_x: float, center_y: float, factor: float) -> None:
+        """Magnifies the drawing `factor` times around (`center_x`, `center_y`), a point of
+        the canvas as currently framed, which moves to the center of the canvas
+        """
+        self.movement_length *= factor
+        self.cursor.x = self.canvas_width / 2 + factor * (self.cursor.x - center_x)
+        self.cursor.y = self.canvas_height / 2 + factor * (self.cursor.y - center_y)
+
+    def render_viewport(
+        self,
+        n: int,
+        center_x: float,
+        center_y: float,
+        factor: float,
+        lod_tolerance: float = 1.0,
+    ) -> None:
+        """Draws the `n`th level magnified `factor` times around (`center_x`, `center_y`),
+        as for `zoom`. The level is never expanded, whatever the engine: the culled
+        interpreter only descends into subtrees on the canvas and draws those smaller
+        than `lod_tolerance` pixels as chords, so levels far too deep to expand can be
+        drawn at any magnification. With the instanced interpreter, small subtrees are
+        placed from their memoized lines as well.
+        """
+        self.check_brackets(n)
+        self.zoom(center_x, center_y, factor)
+        self.lod_tolerance = lod_tolerance
+        instance_symbols = None
+        if self.interpreter == Interpreter.INSTANCED:
+            instance_symbols = INSTANCE_MAX_SYMBOLS
+        self.rasterize(self.trace_culled(n, instance_symbols))
+
+    def predict_draws(self, n: int | None = None) -> int:
+        """Predicts the number of lines running the `n`th level draws, without running it"""
+        return self.level_pen_transducer(n).draws[self.cursor.is_down]
+
+    def iterate_to(self, n: int) -> None:
+        """Iterates the system value up to the `n`th level.
+        With a cache directory, iteration resumes from the deepest checkpointed level
+        and the last unpruned level is checkpointed for later runs.
+        When pruning, the final iteration drops symbols without effect on the drawing.
+        Levels whose brackets cannot be run are rejected before any expansion.
+        Interpreters walking the rule tree from the seed, and the optimizer, only advance
+        the level count, as the stream engine does, since they never read the expanded
+        level.
+        """
+        if n < self.iterations:
+            raise ValueError(
+                f"Already at level {self.iterations}, cannot go back to {n}"
+            )
+        self.check_brackets(n)
+        if self.interpreter in RULE_TREE_INTERPRETERS or (
+            self.interpreter == Interpreter.LOOP and self.optimize
+        ):
+            self.iterations = n
+            if self.prune:
+                self.pruned_symbols = self.count_dead_symbols(n)
+            return
+        unpruned = n - 1 if self.prune else n
+        checkpointed = self.cache_dir is not None and self.engine in (
+            Engine.LIST,
+            Engine.ARRAY,
+            Engine.MMAP,
+            Engine.COMPILED,
+        )
+        if checkpointed:
+            self.load_checkpoint(unpruned)
+        iterated = self.iterations < unpruned
+        while self.iterations < unpruned:
+            self.iterate_system_value()
+        if checkpointed and iterated:
+            self.save_checkpoint()
+        if self.prune and self.iterations < n:
+            self.iterate_system_value(prune=True)
+            self.pruned_symbols = self.count_dead_symbols(n)
+        elif self.prune and self.engine == Engine.STREAM:
+            self.pruned_symbols = self.count_dead_symbols(n)
 
     def iterate_n_then_run(self, n: int):
         """Iterates the L-System `n` times then runs it"""
-        for _ in range(n):
-            self.iterate_system_value()
+        self.iterate_to(self.iterations + n)
         self.run_system_value()
 
 
@@ -277,6 +2839,14 @@ def process_arguments(args: Namespace) -> LSystem:
         args.movelen,
         args.penwidth,
         radians(args.rotatedeg),
+        Engine(args.engine),
+        args.jobs,
+        args.cachedir,
+        args.storagedir,
+        args.prune,
+        args.optimize,
+        Interpreter(args.interpreter),
+        args.lod,
     )
 
 
@@ -336,8 +2906,9 @@ Cursor begins facing to the right
     )
     parser.add_argument(
         "--rotatedeg",
-        type=float,
-        help="Amount in degrees to rotate when + and - commands are used (default 90 degrees)",
+        type=Fraction,
+        help="Amount in degrees to rotate when + and - commands are used, "
+        "also as a fraction like 360/7 (default 90 degrees)",
         default=90.0,
     )
     parser.add_argument(
@@ -353,16 +2924,236 @@ Cursor begins facing to the right
         help="Pen colors in series of hex strings (default ['FFFFFF'])",
         default=["FFFFFF"],
     )
+
+    def numiters(text: str) -> int | None:
+        """Parses a number of iterations, or None for 'auto'"""
+        return None if text == "auto" else int(text)
+
     parser.add_argument(
         "--numiters",
+        type=numiters,
+        help="Number of iterations of L-System to perform before drawing, or 'auto' for "
+        "the most that fit --timebudget and --minsegment (default 10)",
+        default=10,
+    )
+    parser.add_argument(
+        "--timebudget",
+        type=float,
+        help="With --numiters auto, seconds a render is predicted to take at most "
+        "(default 10 when --minsegment is not given either)",
+        default=None,
+    )
+    parser.add_argument(
+        "--minsegment",
+        type=float,
+        help="With --numiters auto, shortest line length in pixels, as chosen by "
+        "--autofit when given (default no limit)",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--engine",
+        type=str,
+        choices=[engine.value for engine in Engine],
+        help="Storage for the system value: 'list' of named commands, compact uint8 "
+        "'array' of opcodes expanded with numpy, 'stream' the final level depth first "
+        "into the turtle without storing it, 'mmap' opcodes in on disk level files, "
+        "'rle' runs of identical symbols rewritten and drawn a run at a time, or "
+        "'compiled' opcodes rewritten and drawn by python code generated for the rules "
+        "(default 'list')",
+        default=Engine.LIST.value,
+    )
+
+    parser.add_argument(
+        "--jobs",
         type=int,
-        help="Number of iterations of L-System to perform before drawing (default 10)",
+        help="Worker processes used to expand large levels with the array engine, and to "
+        "run the level with the parallel interpreter (default 1)",
+        default=1,
+    )
+    parser.add_argument(
+        "--cachedir",
+        type=str,
+        help="Directory keeping the last computed level of each rules and seed, so that "
+        "deeper runs resume from it instead of from the seed (default no cache)",
+        default=None,
+    )
+    parser.add_argument(
+        "--storagedir",
+        type=str,
+        help="Directory the mmap engine writes level files to (default system temp dir)",
+        default=None,
+    )
+    parser.add_argument(
+        "--prune",
+        action="store_true",
+        help="Drop symbols without effect on the drawing (X, Y and Z) from the final level",
+    )
+    parser.add_argument(
+        "--optimize",
+        action="store_true",
+        help="Rewrite the final level into fewer instructions drawing the same image",
+    )
+    parser.add_argument(
+        "--interpreter",
+        type=str,
+        choices=[interpreter.value for interpreter in Interpreter],
+        help="How the final level is run: a python 'loop' over its commands, or numpy "
+        "'vector' scans over the whole level at once, or python loops over chunks of the "
+        "level in --jobs worker 'parallel' processes, or a python loop over the rule tree "
+        "'culled' of subtrees outside the canvas, also placing the lines of small "
+        "subtrees computed once as numpy arrays when 'instanced' (default 'loop')",
+        default=Interpreter.LOOP.value,
+    )
+    parser.add_argument(
+        "--lod",
+        type=float,
+        help="With the 'culled' or 'instanced' interpreter, draw subtrees smaller than "
+        "this many pixels as a single line from where they start to where they end "
+        "(default off, 1.0 with --zoom)",
+        default=None,
+    )
+    parser.add_argument(
+        "--zoom",
+        type=float,
+        help="Draw the final level magnified this many times around --center with the "
+        "'culled' interpreter, or 'instanced' when selected, without expanding it, so "
+        "that close-ups of levels too deep to expand can be drawn; cannot be combined "
+        "with --engine, --prune, --optimize or other interpreters (default off)",
+        default=None,
+    )
+    parser.add_argument(
+        "--center",
+        type=float,
+        nargs=2,
+        metavar=("X", "Y"),
+        help="Point of the canvas, as framed without --zoom, to magnify around "
+        "(default the center of the canvas)",
+        default=None,
+    )
+    parser.add_argument(
+        "--maxsymbols",
+        type=int,
+        help="Refuse to run if the final level is predicted to have more symbols than this "
+        "(default no limit)",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--autofit",
+        action="store_true",
+        help="Choose the movement length and start position so that the drawing fills "
+        "the canvas, overriding --movelen, --startx and --starty; rules must close every "
+        "bracket they open",
+    )
+    parser.add_argument(
+        "--margin",
+        type=int,
+        help="Pixels left empty on each side of the canvas by --autofit (default 10)",
         default=10,
     )
+    parser.add_argument(
+        "--printrange",
+        type=int,
+        nargs=2,
+        metavar=("START", "STOP"),
+        help="Print symbols START to STOP of the final level instead of drawing, "
+        "without expanding the level",
+        default=None,
+    )
 
     args = parser.parse_args()
     lsystem = process_arguments(args)
-    lsystem.iterate_n_then_run(args.numiters)
+    if args.numiters is None:
+        time_budget = args.timebudget
+        if time_budget is None and args.minsegment is None:
+            time_budget = 10.0
+        try:
+            choice = lsystem.choose_depth(
+                time_budget, args.minsegment, args.margin if args.autofit else None
+            )
+        except ValueError as error:
+            parser.error(str(error))
+        print(
+            f"Chose {choice.level} iterations: {choice.symbols} symbols drawing "
+            f"{choice.lines} lines {choice.segment_length:.2f} pixels long, predicted "
+            f"to take {choice.seconds:.1f}s; {choice.reason}"
+        )
+        args.numiters = choice.level
+    if args.printrange is not None:
+        start, stop = args.printrange
+        symbols = lsystem.iter_symbols(start, stop, args.numiters)
+        print("".join(name for name, _ in symbols))
+        return
+    if (
+        args.lod is not None
+        and args.zoom is None
+        and args.interpreter
+        not in (Interpreter.CULLED.value, Interpreter.INSTANCED.value)
+    ):
+        parser.error("--lod requires the culled or instanced interpreter, or --zoom")
+    if args.zoom is not None:
+        unused = [
+            flag
+            for flag, given in (
+                ("--engine", args.engine != Engine.LIST.value),
+                ("--prune", args.prune),
+                ("--optimize", args.optimize),
+                (
+                    "--interpreter",
+                    args.interpreter
+                    not in (
+                        Interpreter.LOOP.value,
+                        Interpreter.CULLED.value,
+                        Interpreter.INSTANCED.value,
+                    ),
+                ),
+            )
+            if given
+        ]
+        if unused:
+            parser.error(
+                "--zoom draws with the 'culled' or 'instanced' interpreter without "
+                f"expanding the level, so it cannot be combined with {', '.join(unused)}"
+            )
+    if args.maxsymbols is not None:
+        prediction = lsystem.predict_growth(args.numiters)
+        if prediction.symbols > args.maxsymbols:
+            deepest = 0
+            while lsystem.predict_growth(deepest + 1).symbols <= args.maxsymbols:
+                deepest += 1
+            parser.error(
+                f"iteration {args.numiters} would have {prediction.symbols} symbols "
+                f"(growth rate {prediction.growth_rate:.3f} per iteration), more than "
+                f"--maxsymbols {args.maxsymbols}; the deepest iteration that fits is {deepest}"
+            )
+    try:
+        lsystem.check_brackets(args.numiters)
+        if (
+            args.autofit
+            or args.zoom is not None
+            or lsystem.interpreter in RULE_TREE_INTERPRETERS
+        ):
+            lsystem.check_rule_brackets()
+        if args.autofit:
+            lsystem.autofit(args.numiters, args.margin)
+    except ValueError as error:
+        parser.error(str(error))
+    if args.zoom is not None:
+        center_x, center_y = args.center or (args.width / 2, args.height / 2)
+        lsystem.render_viewport(
+            args.numiters,
+            center_x,
+            center_y,
+            args.zoom,
+            1.0 if args.lod is None else args.lod,
+        )
+    else:
+        lsystem.iterate_n_then_run(args.numiters)
+    if args.prune:
+        print(f"Pruned {lsystem.pruned_symbols} symbols without effect on the drawing")
+    if args.optimize:
+        print(f"Optimizer eliminated {lsystem.eliminated_instructions} instructions")
     lsystem.canvas.show()
 
 